@@ -4,53 +4,76 @@ ADMIN API Routes — Full control over chats
 Everything grouped under /admin/chats
 """
 
-from fastapi import APIRouter, HTTPException
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional
+import orjson
 from database import (
-    get_messages_by_conversation,
-    delete_messages_by_conversation
+    get_chat_with_messages,
+    iter_messages_by_conversation,
+    delete_messages_by_conversation,
+    delete_messages_by_ids
 )
 from database_Conv import (
     get_all_conversations_admin,
     get_conversation_by_id,
     search_conversations_by_label,
     archive_conversation,
-    delete_conversation
+    delete_conversation,
+    get_conversations_fingerprint,
+    encode_cursor
 )
+from api_helpers import parse_cursor, list_etag, etag_matches
 
 router = APIRouter(prefix="/admin/chats", tags=["Admin - Chats"])
 
 
+# ============================================
+# REQUEST MODELS
+# ============================================
+
+class DeleteMessagesRequest(BaseModel):
+    message_ids: List[int]
+
+
 # ============================================
 # GET: All chats (all users) with pagination
 # ============================================
 
 @router.get("")
-async def admin_get_all_chats(
+def admin_get_all_chats(
+    request: Request,
+    response: Response,
     user_id: Optional[str] = None,
     is_active: Optional[bool] = None,
     page: int = 1,
-    limit: int = 20
+    limit: int = 20,
+    cursor: Optional[str] = None
 ):
     """
     Get all chats across all users
     Filters: user_id, is_active (true/false)
-    Supports pagination
+    Supports pagination → ?page=N, or ?cursor=<next_cursor> for deep paging
+    Sends an ETag → 304 with no body when nothing changed since If-None-Match
     """
+    before = parse_cursor(cursor)
     try:
+        fingerprint = get_conversations_fingerprint(user_id=user_id, is_active=is_active)
+        if fingerprint:
+            etag = list_etag(fingerprint, user_id, is_active, page, limit, cursor)
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
+
         chats, total = get_all_conversations_admin(
             user_id=user_id,
             is_active=is_active,
             page=page,
-            limit=limit
+            limit=limit,
+            before=before
         )
 
-        for c in chats:
-            if c.get('created_at'):
-                c['created_at'] = str(c['created_at'])
-            if c.get('updated_at'):
-                c['updated_at'] = str(c['updated_at'])
-
         total_pages = (total + limit - 1) // limit
 
         return {
@@ -59,6 +82,7 @@ async def admin_get_all_chats(
             "page": page,
             "limit": limit,
             "total_pages": total_pages,
+            "next_cursor": encode_cursor(chats[-1]) if len(chats) == limit else None,
             "chats": chats
         }
     except Exception as e:
@@ -70,11 +94,12 @@ async def admin_get_all_chats(
 # ============================================
 
 @router.get("/search")
-async def admin_search_chats(keyword: str, page: int = 1, limit: int = 20):
+def admin_search_chats(keyword: str, page: int = 1, limit: int = 20, cursor: Optional[str] = None):
     """
     Search chats by label/title keyword
     Example: /admin/chats/search?keyword=machine
     """
+    before = parse_cursor(cursor)
     try:
         if not keyword or len(keyword.strip()) < 1:
             raise HTTPException(status_code=400, detail="Keyword must not be empty")
@@ -82,15 +107,10 @@ async def admin_search_chats(keyword: str, page: int = 1, limit: int = 20):
         chats, total = search_conversations_by_label(
             keyword=keyword,
             page=page,
-            limit=limit
+            limit=limit,
+            before=before
         )
 
-        for c in chats:
-            if c.get('created_at'):
-                c['created_at'] = str(c['created_at'])
-            if c.get('updated_at'):
-                c['updated_at'] = str(c['updated_at'])
-
         total_pages = (total + limit - 1) // limit
 
         return {
@@ -100,6 +120,7 @@ async def admin_search_chats(keyword: str, page: int = 1, limit: int = 20):
             "page": page,
             "limit": limit,
             "total_pages": total_pages,
+            "next_cursor": encode_cursor(chats[-1]) if len(chats) == limit else None,
             "chats": chats
         }
     except HTTPException:
@@ -113,21 +134,17 @@ async def admin_search_chats(keyword: str, page: int = 1, limit: int = 20):
 # ============================================
 
 @router.get("/user/{user_id}")
-async def admin_get_user_chats(user_id: str, page: int = 1, limit: int = 20):
+def admin_get_user_chats(user_id: str, page: int = 1, limit: int = 20, cursor: Optional[str] = None):
     """Get all chats for a specific user"""
+    before = parse_cursor(cursor)
     try:
         chats, total = get_all_conversations_admin(
             user_id=user_id,
             page=page,
-            limit=limit
+            limit=limit,
+            before=before
         )
 
-        for c in chats:
-            if c.get('created_at'):
-                c['created_at'] = str(c['created_at'])
-            if c.get('updated_at'):
-                c['updated_at'] = str(c['updated_at'])
-
         total_pages = (total + limit - 1) // limit
 
         return {
@@ -137,6 +154,7 @@ async def admin_get_user_chats(user_id: str, page: int = 1, limit: int = 20):
             "page": page,
             "limit": limit,
             "total_pages": total_pages,
+            "next_cursor": encode_cursor(chats[-1]) if len(chats) == limit else None,
             "chats": chats
         }
     except Exception as e:
@@ -148,30 +166,21 @@ async def admin_get_user_chats(user_id: str, page: int = 1, limit: int = 20):
 # ============================================
 
 @router.get("/{chat_id}")
-async def admin_get_chat(chat_id: int):
+def admin_get_chat(chat_id: int, stream: bool = False):
     """
     Get a single chat with ALL its messages
     Returns chat details + messages in one response
+    ?stream=1 → NDJSON, one message per line (no limit, constant memory)
     """
+    if stream:
+        return stream_chat_messages(chat_id)
+
     try:
-        # Get chat details
-        chat = get_conversation_by_id(chat_id)
+        # Chat details + all its messages in one DB round trip
+        chat, messages = get_chat_with_messages(chat_id)
         if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
 
-        # Convert datetime
-        if chat.get('created_at'):
-            chat['created_at'] = str(chat['created_at'])
-        if chat.get('updated_at'):
-            chat['updated_at'] = str(chat['updated_at'])
-
-        # Get all messages of this chat
-        messages = get_messages_by_conversation(chat_id)
-
-        for m in messages:
-            if m.get('created_at'):
-                m['created_at'] = str(m['created_at'])
-
         return {
             "status": "success",
             "chat": chat,
@@ -184,12 +193,24 @@ async def admin_get_chat(chat_id: int):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+def stream_chat_messages(chat_id: int):
+    """NDJSON export of a chat's messages"""
+    if not get_conversation_by_id(chat_id):
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    def ndjson_lines():
+        for message in iter_messages_by_conversation(chat_id):
+            yield orjson.dumps(message) + b"\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
 # ============================================
 # DELETE: All messages in a chat (keep the chat)
 # ============================================
 
 @router.delete("/{chat_id}/messages")
-async def admin_delete_chat_messages(chat_id: int):
+def admin_delete_chat_messages(chat_id: int):
     """
     Delete ALL messages inside a chat
     The chat itself stays — only messages are removed
@@ -213,21 +234,47 @@ async def admin_delete_chat_messages(chat_id: int):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+# ============================================
+# POST: Delete selected messages in a chat (bulk)
+# ============================================
+
+@router.post("/{chat_id}/messages/delete")
+def admin_delete_selected_messages(chat_id: int, request: DeleteMessagesRequest):
+    """
+    Delete several messages of a chat in one go
+    Body: {"message_ids": [1, 2, 3]} → single DELETE ... WHERE id IN (...)
+    Ids that don't belong to this chat are ignored
+    """
+    try:
+        deleted_count = delete_messages_by_ids(request.message_ids, conversation_id=chat_id)
+        if deleted_count is False:
+            raise HTTPException(status_code=500, detail="Failed to delete messages")
+
+        return {
+            "status": "success",
+            "message": "Messages deleted",
+            "chat_id": chat_id,
+            "deleted_count": deleted_count
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
 # ============================================
 # PUT: Archive a chat
 # ============================================
 
 @router.put("/{chat_id}/archive")
-async def admin_archive_chat(chat_id: int):
+def admin_archive_chat(chat_id: int):
     """Archive a chat — sets is_active = FALSE"""
     try:
-        chat = get_conversation_by_id(chat_id)
-        if not chat:
-            raise HTTPException(status_code=404, detail="Chat not found")
-
-        success = archive_conversation(chat_id)
-        if not success:
+        archived = archive_conversation(chat_id)
+        if archived is False:
             raise HTTPException(status_code=500, detail="Failed to archive")
+        if not archived:
+            raise HTTPException(status_code=404, detail="Chat not found")
 
         return {
             "status": "success",
@@ -245,23 +292,18 @@ async def admin_archive_chat(chat_id: int):
 # ============================================
 
 @router.delete("/{chat_id}")
-async def admin_delete_chat(chat_id: int):
+def admin_delete_chat(chat_id: int):
     """
     Permanently delete a chat AND all its messages
     Cannot be undone
     """
     try:
-        chat = get_conversation_by_id(chat_id)
-        if not chat:
-            raise HTTPException(status_code=404, detail="Chat not found")
-
-        # Delete messages first
-        delete_messages_by_conversation(chat_id)
-
-        # Then delete the chat
-        success = delete_conversation(chat_id)
-        if not success:
+        # Messages are removed by ON DELETE CASCADE
+        deleted = delete_conversation(chat_id)
+        if deleted is False:
             raise HTTPException(status_code=500, detail="Failed to delete chat")
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Chat not found")
 
         return {
             "status": "success",
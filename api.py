@@ -4,10 +4,10 @@ FRONTEND API Routes — Sidebar chat management
 All routes under /conversations
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import Optional
-from database import get_messages_by_conversation, delete_messages_by_conversation
+from database import get_messages_by_conversation
 from database_Conv import (
     get_all_conversations,
     get_conversation_by_id,
@@ -15,8 +15,11 @@ from database_Conv import (
     switch_conversation,
     update_conversation_label,
     archive_conversation,
-    delete_conversation
+    delete_conversation,
+    get_conversations_fingerprint,
+    encode_cursor
 )
+from api_helpers import parse_cursor, list_etag, etag_matches
 
 router = APIRouter(prefix="/conversations", tags=["Frontend - Conversations"])
 
@@ -41,26 +44,30 @@ class SwitchConversationRequest(BaseModel):
 # ============================================
 
 @router.get("/{user_id}")
-async def list_conversations(user_id: str, limit: int = 50):
+def list_conversations(request: Request, response: Response, user_id: str, limit: int = 50, cursor: Optional[str] = None):
     """
     Get all conversations for a user
     Frontend uses this to populate the sidebar
     Returns: label, last message preview, message count, is_active
+    Pass ?cursor=<next_cursor> to load the next page
+    Sends an ETag → 304 with no body when nothing changed since If-None-Match
     """
+    before = parse_cursor(cursor)
     try:
-        conversations = get_all_conversations(user_id, limit)
+        fingerprint = get_conversations_fingerprint(user_id=user_id)
+        if fingerprint:
+            etag = list_etag(fingerprint, limit, cursor)
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
 
-        # Convert datetime objects to strings for JSON
-        for c in conversations:
-            if c.get('created_at'):
-                c['created_at'] = str(c['created_at'])
-            if c.get('updated_at'):
-                c['updated_at'] = str(c['updated_at'])
+        conversations = get_all_conversations(user_id, limit, before=before)
 
         return {
             "status": "success",
             "user_id": user_id,
             "total": len(conversations),
+            "next_cursor": encode_cursor(conversations[-1]) if len(conversations) == limit else None,
             "conversations": conversations
         }
     except Exception as e:
@@ -72,7 +79,7 @@ async def list_conversations(user_id: str, limit: int = 50):
 # ============================================
 
 @router.post("/create")
-async def create_new_conversation(request: CreateConversationRequest):
+def create_new_conversation(request: CreateConversationRequest):
     """
     Create a new chat
     Deactivates the current active chat automatically
@@ -86,12 +93,6 @@ async def create_new_conversation(request: CreateConversationRequest):
         if not new_conv:
             raise HTTPException(status_code=500, detail="Failed to create conversation")
 
-        # Convert datetime
-        if new_conv.get('created_at'):
-            new_conv['created_at'] = str(new_conv['created_at'])
-        if new_conv.get('updated_at'):
-            new_conv['updated_at'] = str(new_conv['updated_at'])
-
         return {
             "status": "success",
             "message": "New chat created",
@@ -108,7 +109,7 @@ async def create_new_conversation(request: CreateConversationRequest):
 # ============================================
 
 @router.get("/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: int, limit: int = 100):
+def get_conversation_messages(conversation_id: int, limit: int = 100):
     """
     Load all messages when user clicks a chat in sidebar
     Returns messages in chronological order (oldest first)
@@ -121,11 +122,6 @@ async def get_conversation_messages(conversation_id: int, limit: int = 100):
 
         messages = get_messages_by_conversation(conversation_id, limit)
 
-        # Convert datetime objects
-        for m in messages:
-            if m.get('created_at'):
-                m['created_at'] = str(m['created_at'])
-
         return {
             "status": "success",
             "conversation_id": conversation_id,
@@ -143,18 +139,16 @@ async def get_conversation_messages(conversation_id: int, limit: int = 100):
 # ============================================
 
 @router.put("/{conversation_id}/label")
-async def rename_conversation(conversation_id: int, request: RenameConversationRequest):
+def rename_conversation(conversation_id: int, request: RenameConversationRequest):
     """
     Rename a chat from sidebar (user edits the title)
     """
     try:
-        conversation = get_conversation_by_id(conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Chat not found")
-
-        success = update_conversation_label(conversation_id, request.label)
-        if not success:
+        updated = update_conversation_label(conversation_id, request.label)
+        if updated is False:
             raise HTTPException(status_code=500, detail="Failed to rename")
+        if not updated:
+            raise HTTPException(status_code=404, detail="Chat not found")
 
         return {
             "status": "success",
@@ -173,24 +167,19 @@ async def rename_conversation(conversation_id: int, request: RenameConversationR
 # ============================================
 
 @router.put("/{conversation_id}/switch")
-async def switch_chat(conversation_id: int, request: SwitchConversationRequest):
+def switch_chat(conversation_id: int, request: SwitchConversationRequest):
     """
     User clicks an old chat in sidebar
     → Sets that chat as active
     → Next messages will go into this chat
     """
     try:
-        conversation = get_conversation_by_id(conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Chat not found")
-
-        # Verify this conversation belongs to the user
-        if conversation['user_id'] != request.user_id:
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        success = switch_conversation(request.user_id, conversation_id)
-        if not success:
+        # Only matches a chat owned by this user → 0 rows covers missing + not yours
+        switched = switch_conversation(request.user_id, conversation_id)
+        if switched is False:
             raise HTTPException(status_code=500, detail="Failed to switch chat")
+        if not switched:
+            raise HTTPException(status_code=404, detail="Chat not found")
 
         return {
             "status": "success",
@@ -208,19 +197,17 @@ async def switch_chat(conversation_id: int, request: SwitchConversationRequest):
 # ============================================
 
 @router.put("/{conversation_id}/archive")
-async def archive_chat(conversation_id: int):
+def archive_chat(conversation_id: int):
     """
     Archive/close a chat
     Chat stays in sidebar but marked as inactive
     """
     try:
-        conversation = get_conversation_by_id(conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Chat not found")
-
-        success = archive_conversation(conversation_id)
-        if not success:
+        archived = archive_conversation(conversation_id)
+        if archived is False:
             raise HTTPException(status_code=500, detail="Failed to archive")
+        if not archived:
+            raise HTTPException(status_code=404, detail="Chat not found")
 
         return {
             "status": "success",
@@ -238,23 +225,18 @@ async def archive_chat(conversation_id: int):
 # ============================================
 
 @router.delete("/{conversation_id}")
-async def delete_chat(conversation_id: int):
+def delete_chat(conversation_id: int):
     """
     Delete a chat and ALL its messages permanently
     Cannot be undone
     """
     try:
-        conversation = get_conversation_by_id(conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Chat not found")
-
-        # Delete all messages first
-        delete_messages_by_conversation(conversation_id)
-
-        # Then delete the conversation
-        success = delete_conversation(conversation_id)
-        if not success:
+        # Messages are removed by ON DELETE CASCADE
+        deleted = delete_conversation(conversation_id)
+        if deleted is False:
             raise HTTPException(status_code=500, detail="Failed to delete chat")
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Chat not found")
 
         return {
             "status": "success",
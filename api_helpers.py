@@ -0,0 +1,35 @@
+"""
+api_helpers.py
+Shared helpers for the list routes in api.py and admin_api.py
+Keyset cursor parsing + ETag / If-None-Match handling
+"""
+
+from fastapi import HTTPException, Request
+from typing import Optional
+import hashlib
+from database_Conv import decode_cursor
+
+
+def parse_cursor(cursor: Optional[str]):
+    """Decode the ?cursor= keyset token, 400 if it was tampered with"""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def list_etag(fingerprint, *query):
+    """Strong ETag for one page of a list → data fingerprint + the query that shaped the page"""
+    raw = "|".join(str(part) for part in (*fingerprint, *query))
+    return '"' + hashlib.blake2s(raw.encode(), digest_size=8).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str):
+    """True when the client's If-None-Match already holds this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag in tags or "*" in tags
@@ -1,11 +1,16 @@
 import os
+import re
 import base64
-from groq import Groq
+import mmap
+import asyncio
+import threading
+from cachetools import LRUCache
+from groq import AsyncGroq
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
 
 # Define models at module level
 VISION_MODELS = [
@@ -13,92 +18,162 @@ VISION_MODELS = [
 ]
 TEXT_MODEL = "llama-3.3-70b-versatile"
 
+# Upper bound (seconds) for the whole vision race before falling back to text
+VISION_TIMEOUT = 60
+
+TEXT_FALLBACK_NOTE = "\n\n(Note: Image processed via text fallback as vision models are currently unavailable.)"
+
+# (path, mtime, size) → base64, bounded by total encoded BYTES, not entry count
+# Files whose base64 would be over a quarter of the budget are encoded but not kept
+ENCODED_CACHE_BYTES = 64 * 1024 * 1024
+_encoded_cache = LRUCache(maxsize=ENCODED_CACHE_BYTES, getsizeof=len)
+_encoded_cache_lock = threading.Lock()
+
+def _encode_file(path, size):
+    """base64 of a file"""
+    with open(path, "rb") as image_file:
+        if size == 0:
+            return ""
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return base64.b64encode(mm).decode('utf-8')
+
 def encode_image(image_path):
     """Helper to encode local images to base64 for the Vision API."""
     try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        st = os.stat(image_path)
+        key = (image_path, st.st_mtime_ns, st.st_size)  # edits invalidate the entry
+        with _encoded_cache_lock:
+            cached = _encoded_cache.get(key)
+        if cached is not None:
+            return cached
+
+        encoded = _encode_file(image_path, st.st_size)
+        if len(encoded) <= ENCODED_CACHE_BYTES // 4:
+            with _encoded_cache_lock:
+                _encoded_cache[key] = encoded
+        return encoded
     except Exception as e:
         print(f"Error encoding image: {e}")
         return None
 
-def get_ai_response(user_message, history):
+# Upload messages written before chat_history.attachments existed
+LEGACY_IMAGE_PREFIX = "SYSTEM: User uploaded an image:"
+# One pass instead of "uploads/" in + .lower() + an `in` per extension
+IMAGE_URL_RE = re.compile(r"uploads/([^\s\)\]]+\.(?:png|jpe?g))", re.IGNORECASE)
+
+def legacy_image_paths(content):
+    """Recover the image path from an old-style upload message"""
+    if not content.startswith(LEGACY_IMAGE_PREFIX):
+        return []
+    match = IMAGE_URL_RE.search(content)
+    if match:
+        return [os.path.join("uploads", os.path.basename(match.group(1)))]
+    return []
+
+async def _first_vision_reply(tasks):
+    """Wait for the first vision task that succeeds, None if all of them fail"""
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            try:
+                return task.result().choices[0].message.content
+            except Exception as e:
+                print(f"Vision model {tasks[task]} failed: {e}")
+    return None
+
+async def race_vision_models(messages):
+    """
+    Query every vision model at once and keep the fastest successful reply
+    Losers are cancelled → latency is the quickest healthy model, not the sum of failures
+    """
+    tasks = {
+        asyncio.create_task(client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=2048
+        )): model_name
+        for model_name in VISION_MODELS
+    }
     try:
-        has_image = False
-        processed_messages = []
-        
-        # 1. System Message
-        system_content = ("You are Chat-Bot, a custom assistant for Technowire Data Science Ltd. "
-                          "You have vision capabilities. If an image is provided, analyze it accurately. "
-                          "You also process PDF text provided in the history. "
-                          "Never mention OpenAI, Groq, Meta, or Llama. Be professional and concise.")
-        
-        # 2. Process History and check for images
-        for chat in history:
-            role = chat['role']
-            content = chat['content']
-            
-            # Check for image triggers 
-            if "uploads/" in content and any(ext in content.lower() for ext in [".png", ".jpg", ".jpeg"]):
-                filename = content.split("/")[-1].split(")")[0].split("]")[0].strip()
-                file_path = os.path.join("uploads", filename)
-                
-                if os.path.exists(file_path):
-                    base64_image = encode_image(file_path)
-                    if base64_image:
-                        has_image = True
-                        processed_messages.append({
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": f"[User uploaded image: {filename}]"},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                            ]
-                        })
-                        continue 
-            
-            processed_messages.append({"role": role, "content": content})
-
-        # 3. Add current user message
-        processed_messages.append({"role": "user", "content": user_message})
-
-        # 4. Final Formatting for API
-        final_messages = [{"role": "system", "content": system_content}]
-        for m in processed_messages:
-            if has_image:
-                if isinstance(m["content"], str):
-                    final_messages.append({
-                        "role": m["role"],
-                        "content": [{"type": "text", "text": m["content"]}]
-                    })
-                else:
-                    final_messages.append(m)
-            else:
-                final_messages.append(m)
-
-        # 5. Use vision model if image exists
+        return await asyncio.wait_for(_first_vision_reply(tasks), timeout=VISION_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Vision models timed out after {VISION_TIMEOUT}s")
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+SYSTEM_CONTENT = ("You are Chat-Bot, a custom assistant for Technowire Data Science Ltd. "
+                  "You have vision capabilities. If an image is provided, analyze it accurately. "
+                  "You also process PDF text provided in the history. "
+                  "Never mention OpenAI, Groq, Meta, or Llama. Be professional and concise.")
+
+def system_content(documents=None):
+    """System prompt + the uploaded-file excerpts retrieved for this question"""
+    if not documents:
+        return SYSTEM_CONTENT
+    excerpts = "\n\n".join(f"[{filename}]\n{chunk}" for filename, chunk in documents)
+    return (f"{SYSTEM_CONTENT}\n\nExcerpts from files the user uploaded in this chat "
+            f"(use them ONLY if relevant to the question):\n{excerpts}")
+
+def build_messages(user_message, history, documents=None):
+    """
+    Build the prompt once
+    text_messages → plain-string form (canonical, used by the text model)
+    image_blocks  → {index in text_messages: block content} for messages carrying images
+    documents     → [(filename, chunk)] spliced into the system prompt
+    """
+    text_messages = [{"role": "system", "content": system_content(documents)}]
+    image_blocks = {}
+
+    for chat in history:
+        role = chat['role']
+        content = chat['content']
+        image_paths = chat.get('attachments') or legacy_image_paths(content)
+
+        image_parts = []
+        for file_path in image_paths:
+            if os.path.exists(file_path):
+                base64_image = encode_image(file_path)
+                if base64_image:
+                    image_parts.append({"type": "text", "text": f"[User uploaded image: {os.path.basename(file_path)}]"})
+                    image_parts.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}})
+
+        if image_parts:
+            # Keep the caption as the text-model version of this message
+            image_blocks[len(text_messages)] = image_parts
+            text_messages.append({"role": "user", "content": image_parts[0]["text"]})
+            continue
+
+        text_messages.append({"role": role, "content": content})
+
+    # Add current user message
+    text_messages.append({"role": "user", "content": user_message})
+    return text_messages, image_blocks
+
+def to_vision_messages(text_messages, image_blocks):
+    """Block form for vision models — only built when the chat has images"""
+    vision_messages = [text_messages[0]]
+    for i, m in enumerate(text_messages[1:], start=1):
+        content = image_blocks.get(i) or [{"type": "text", "text": m["content"]}]
+        vision_messages.append({"role": m["role"], "content": content})
+    return vision_messages
+
+async def get_ai_response(user_message, history, documents=None):
+    try:
+        text_messages, image_blocks = build_messages(user_message, history, documents)
+        has_image = bool(image_blocks)
+
+        # Use vision model if image exists (all models raced in parallel)
         if has_image:
-            for model_name in VISION_MODELS:
-                try:
-                    response = client.chat.completions.create(
-                        model=model_name,
-                        messages=final_messages,
-                        temperature=0.7,
-                        max_tokens=2048
-                    )
-                    return response.choices[0].message.content
-                except Exception as e:
-                    print(f"Vision model {model_name} failed: {e}")
-                    continue
-
-        # 6. Fallback to Text Model
-        text_messages = [{"role": "system", "content": system_content}]
-        for m in processed_messages:
-            content = m["content"]
-            if isinstance(content, list):
-                content = next((item["text"] for item in content if item["type"] == "text"), "")
-            text_messages.append({"role": m["role"], "content": content})
-
-        response = client.chat.completions.create(
+            reply = await race_vision_models(to_vision_messages(text_messages, image_blocks))
+            if reply is not None:
+                return reply
+
+        # Fallback to Text Model
+        response = await client.chat.completions.create(
             model=TEXT_MODEL,
             messages=text_messages,
             temperature=0.7,
@@ -107,9 +182,46 @@ def get_ai_response(user_message, history):
         
         reply = response.choices[0].message.content
         if has_image:
-            reply += "\n\n(Note: Image processed via text fallback as vision models are currently unavailable.)"
+            reply += TEXT_FALLBACK_NOTE
         return reply
 
     except Exception as e:
         print(f"CRITICAL AI ERROR: {str(e)}")
         return f"AI Error: {str(e)}"
+
+async def stream_ai_response(user_message, history, documents=None, state=None):
+    """
+    Same prompt + models as get_ai_response, but yields the reply piece by piece
+    Text model → tokens as Groq sends them; vision race → the whole reply at once
+    state → dict; state["error"] is set when the model call fails (after the error text is yielded)
+    """
+    try:
+        text_messages, image_blocks = build_messages(user_message, history, documents)
+        has_image = bool(image_blocks)
+
+        if has_image:
+            reply = await race_vision_models(to_vision_messages(text_messages, image_blocks))
+            if reply is not None:
+                yield reply
+                return
+
+        stream = await client.chat.completions.create(
+            model=TEXT_MODEL,
+            messages=text_messages,
+            temperature=0.7,
+            max_tokens=2048,
+            stream=True
+        )
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                yield token
+
+        if has_image:
+            yield TEXT_FALLBACK_NOTE
+
+    except Exception as e:
+        print(f"CRITICAL AI ERROR: {str(e)}")
+        if state is not None:
+            state["error"] = True
+        yield f"AI Error: {str(e)}"
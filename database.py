@@ -1,103 +1,249 @@
 
-import mysql.connector
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from contextlib import contextmanager
+import json
+from functools import lru_cache
+import db_common
+from db_common import (
+    release_connection, invalidate_sidebar, pop_window_total, prepared_cursor, drop_prepared_cursors,
+    HISTORY_CACHE_ENABLED, HISTORY_CACHE_SIZE, fill_history, record_history, forget_history, cached_history
+)
 
 # ============================================
 # CONNECTION
 # ============================================
 
+POOL_NAME = "chatbot"
+
+
 def get_db_connection():
+    """Borrow a connection from the chat_history pool (db_common.get_db_connection)"""
+    return db_common.get_db_connection(POOL_NAME)
+
+
+@contextmanager
+def get_conn():
+    """
+    with get_conn() as conn: ...
+    Yields None when the database is unreachable, always releases the connection
+    """
+    conn = get_db_connection()
     try:
-        return mysql.connector.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            port=24253,
-            user=os.getenv("DB_USER", "root"),
-            password=os.getenv("DB_PASSWORD", ""),
-            database=os.getenv("DB_NAME", "chatbot_db"),
-            connect_timeout=5
-        )
-    except Exception as e:
-        print(f"DATABASE CONNECTION ERROR: {e}")
-        return None
+        yield conn
+    finally:
+        if conn:
+            release_connection(conn)
 
 
+# ============================================
+# PREPARED STATEMENTS
+# ============================================
+
+INSERT_MSG_SQL = """
+    INSERT INTO chat_history (user_id, role, content, conversation_id, attachments)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+SELECT_HISTORY_SQL = """
+    SELECT role, content, attachments FROM chat_history
+    WHERE user_id = %s AND conversation_id = %s
+    ORDER BY id DESC
+    LIMIT %s
+"""
+
+# Same, but only messages older than the one just stored (ensure_and_store)
+SELECT_HISTORY_BEFORE_SQL = """
+    SELECT role, content, attachments FROM chat_history
+    WHERE user_id = %s AND conversation_id = %s AND id < %s
+    ORDER BY id DESC
+    LIMIT %s
+"""
+
+# Cache fill: newest messages incl. ids (chronological order restored in Python)
+SELECT_HISTORY_TAIL_SQL = """
+    SELECT id, role, content, attachments FROM chat_history
+    WHERE user_id = %s AND conversation_id = %s
+    ORDER BY id DESC
+    LIMIT %s
+"""
+
+SELECT_HISTORY_BY_USER_SQL = """
+    SELECT role, content, attachments FROM chat_history
+    WHERE user_id = %s
+    ORDER BY id DESC
+    LIMIT %s
+"""
+
+SELECT_CONV_MESSAGES_SQL = """
+    SELECT id, user_id, role, content, conversation_id,
+           DATE_FORMAT(created_at, '%Y-%m-%d %T') AS created_at
+    FROM chat_history
+    WHERE conversation_id = %s
+    ORDER BY id ASC
+    LIMIT %s
+"""
+
 # ============================================
 # STORE MESSAGE
 # ============================================
 
-def store_message(user_id: str, role: str, content: str, conversation_id: int = None):
+def store_message(user_id: str, role: str, content: str, conversation_id: int = None, attachments: list = None):
     """
     Insert a message into chat_history
     conversation_id is now passed directly - no more timestamp guessing
+    attachments → list of uploaded file paths (images) tied to this message
     """
-    conn = get_db_connection()
-    if not conn:
-        print("Skipping store_message: No database connection.")
-        return None
+    with get_conn() as conn:
+        if not conn:
+            print("Skipping store_message: No database connection.")
+            return None
+
+        try:
+            cursor = prepared_cursor(conn, INSERT_MSG_SQL)
+            cursor.execute(INSERT_MSG_SQL, (
+                user_id, role, content, conversation_id,
+                json.dumps(attachments) if attachments else None
+            ))
+            conn.commit()
+            invalidate_sidebar(user_id)
+            record_history(user_id, conversation_id, cursor.lastrowid, role, content, attachments)
+            return cursor.lastrowid  # Return the new message id
+        except Exception as e:
+            print(f"Error storing message: {e}")
+            drop_prepared_cursors(conn)
+            return None
 
-    try:
-        cursor = conn.cursor()
-        query = """
-            INSERT INTO chat_history (user_id, role, content, conversation_id)
-            VALUES (%s, %s, %s, %s)
-        """
-        cursor.execute(query, (user_id, role, content, conversation_id))
-        conn.commit()
-        message_id = cursor.lastrowid
-        cursor.close()
-        return message_id  # Return the new message id
-    except Exception as e:
-        print(f"Error storing message: {e}")
-        return None
-    finally:
-        conn.close()
+
+# ============================================
+# STORE MESSAGES (bulk)
+# ============================================
+
+def store_messages_bulk(rows: list):
+    """
+    Insert several messages with one multi-row INSERT and one commit
+    rows → (user_id, role, content, conversation_id[, attachments]) tuples
+    Returns number of inserted rows, None on failure
+    """
+    if not rows:
+        return 0
+
+    params = [
+        (user_id, role, content, conversation_id, json.dumps(extra[0]) if extra and extra[0] else None)
+        for user_id, role, content, conversation_id, *extra in rows
+    ]
+
+    with get_conn() as conn:
+        if not conn:
+            print("Skipping store_messages_bulk: No database connection.")
+            return None
+
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(INSERT_MSG_SQL, params)  # rewritten into a single INSERT ... VALUES (...), (...)
+            conn.commit()
+            for user_id in {row[0] for row in params}:
+                invalidate_sidebar(user_id)
+            for conversation_id in {row[3] for row in params}:
+                forget_history(conversation_id)
+            inserted = cursor.rowcount
+            cursor.close()
+            return inserted
+        except Exception as e:
+            print(f"Error storing messages: {e}")
+            conn.rollback()
+            return None
 
 
 # ============================================
 # GET CHAT HISTORY
 # ============================================
 
-def get_chat_history(user_id: str, conversation_id: int = None, limit: int = 15):
+# Uploaded-file context is cut to this many chars when replayed as history
+BACKGROUND_HISTORY_CHARS = 500
+
+
+def estimate_tokens(text: str) -> int:
+    """~4 chars per token for English — close enough for budgeting, no tokenizer needed"""
+    return len(text) // 4 + 4  # + per-message role/framing overhead
+
+
+def fit_token_budget(history: list, max_tokens: int):
+    """
+    Newest → oldest, keep messages until max_tokens is spent (the newest one always stays)
+    BACKGROUND_DATA upload context is shortened first so one file can't eat the budget
+    """
+    kept = []
+    used = 0
+    for message in reversed(history):
+        content = message["content"] or ""
+        if content.startswith("BACKGROUND_DATA:") and len(content) > BACKGROUND_HISTORY_CHARS:
+            # Copy → cached history dicts are shared
+            message = {**message, "content": content[:BACKGROUND_HISTORY_CHARS]}
+            content = message["content"]
+        used += estimate_tokens(content)
+        if kept and used > max_tokens:
+            break
+        kept.append(message)
+    kept.reverse()
+    return kept
+
+
+def get_chat_history(user_id: str, conversation_id: int = None, limit: int = 15, before_id: int = None, max_tokens: int = None):
     """
     Get chat history for AI context
     If conversation_id is passed → get messages from THAT conversation only
     If not → fallback to user_id (old behavior for safety)
+    before_id → only messages older than this id (skip the message just stored)
+    max_tokens → also stop at this (estimated) token budget, newest messages first
+    Served from the in-process history cache when it holds enough messages
     """
-    conn = get_db_connection()
-    if not conn:
-        return []
-
-    try:
-        cursor = conn.cursor(dictionary=True)
-
-        if conversation_id:
-            query = """
-                SELECT role, content FROM chat_history
-                WHERE user_id = %s AND conversation_id = %s
-                ORDER BY id DESC
-                LIMIT %s
-            """
-            cursor.execute(query, (user_id, conversation_id, limit))
-        else:
-            query = """
-                SELECT role, content FROM chat_history
-                WHERE user_id = %s
-                ORDER BY id DESC
-                LIMIT %s
-            """
-            cursor.execute(query, (user_id, limit))
-
-        history = cursor.fetchall()
-        cursor.close()
-        return history[::-1]  # Reverse → chronological order for AI
-    except Exception as e:
-        print(f"Error fetching chat history: {e}")
-        return []
-    finally:
-        conn.close()
+    history = _load_chat_history(user_id, conversation_id, limit, before_id)
+    if max_tokens:
+        return fit_token_budget(history, max_tokens)
+    return history
+
+
+def _load_chat_history(user_id: str, conversation_id: int, limit: int, before_id: int):
+    """Last `limit` messages, oldest first (cache → DB)"""
+    use_cache = HISTORY_CACHE_ENABLED and conversation_id and limit < HISTORY_CACHE_SIZE
+    if use_cache:
+        history = cached_history(user_id, conversation_id, limit, before_id)
+        if history is not None:
+            return history
+
+    with get_conn() as conn:
+        if not conn:
+            return []
+
+        try:
+            if use_cache:
+                # (Re)fill the cached suffix, then answer from it
+                cursor = prepared_cursor(conn, SELECT_HISTORY_TAIL_SQL)
+                cursor.execute(SELECT_HISTORY_TAIL_SQL, (user_id, conversation_id, HISTORY_CACHE_SIZE))
+                fill_history(user_id, conversation_id, cursor.fetchall())
+                history = cached_history(user_id, conversation_id, limit, before_id)
+                if history is not None:
+                    return history
+
+            if conversation_id and before_id:
+                cursor = prepared_cursor(conn, SELECT_HISTORY_BEFORE_SQL)
+                cursor.execute(SELECT_HISTORY_BEFORE_SQL, (user_id, conversation_id, before_id, limit))
+            elif conversation_id:
+                cursor = prepared_cursor(conn, SELECT_HISTORY_SQL)
+                cursor.execute(SELECT_HISTORY_SQL, (user_id, conversation_id, limit))
+            else:
+                cursor = prepared_cursor(conn, SELECT_HISTORY_BY_USER_SQL)
+                cursor.execute(SELECT_HISTORY_BY_USER_SQL, (user_id, limit))
+
+            # Tuple rows (role, content, attachments) → no per-row dict from the cursor
+            rows = cursor.fetchall()
+            return [
+                {"role": role, "content": content, "attachments": json.loads(attachments) if attachments else None}
+                for role, content, attachments in reversed(rows)  # Reverse → chronological order for AI
+            ]
+        except Exception as e:
+            print(f"Error fetching chat history: {e}")
+            drop_prepared_cursors(conn)
+            return []
 
 
 # ============================================
@@ -109,28 +255,97 @@ def get_messages_by_conversation(conversation_id: int, limit: int = 100):
     Get all messages of a specific conversation
     Used when user clicks a chat in sidebar
     """
-    conn = get_db_connection()
-    if not conn:
-        return []
+    with get_conn() as conn:
+        if not conn:
+            return []
 
-    try:
-        cursor = conn.cursor(dictionary=True)
-        query = """
-            SELECT id, user_id, role, content, conversation_id, created_at
-            FROM chat_history
-            WHERE conversation_id = %s
-            ORDER BY id ASC
-            LIMIT %s
-        """
-        cursor.execute(query, (conversation_id, limit))
-        messages = cursor.fetchall()
-        cursor.close()
-        return messages
-    except Exception as e:
-        print(f"Error fetching messages: {e}")
-        return []
-    finally:
-        conn.close()
+        try:
+            cursor = prepared_cursor(conn, SELECT_CONV_MESSAGES_SQL, dictionary=True)
+            cursor.execute(SELECT_CONV_MESSAGES_SQL, (conversation_id, limit))
+            return cursor.fetchall()
+        except Exception as e:
+            print(f"Error fetching messages: {e}")
+            drop_prepared_cursors(conn)
+            return []
+
+
+# ============================================
+# STREAM MESSAGES BY CONVERSATION (admin export)
+# ============================================
+
+def iter_messages_by_conversation(conversation_id: int):
+    """
+    Yield messages of a conversation one row at a time (oldest first)
+    Unbuffered cursor → rows come off the socket as they're consumed,
+    so memory stays flat no matter how long the chat is
+    """
+    with get_conn() as conn:
+        if not conn:
+            return
+
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        try:
+            cursor.execute("""
+                SELECT id, user_id, role, content, conversation_id,
+                       DATE_FORMAT(created_at, '%Y-%m-%d %T') AS created_at
+                FROM chat_history
+                WHERE conversation_id = %s
+                ORDER BY id ASC
+            """, (conversation_id,))
+            for row in cursor:
+                yield row
+        except Exception as e:
+            print(f"Error streaming messages: {e}")
+        finally:
+            # Client may disconnect mid-stream → drain so the pooled connection is reusable
+            try:
+                conn.consume_results()
+                cursor.close()
+            except Exception as e:
+                print(f"Error closing message stream: {e}")
+
+
+# ============================================
+# GET CHAT + MESSAGES (admin detail, one round trip)
+# ============================================
+
+CHAT_WITH_MESSAGES_SQL = """
+    SELECT id, user_id, label, is_active,
+           DATE_FORMAT(created_at, '%Y-%m-%d %T') AS created_at,
+           DATE_FORMAT(updated_at, '%Y-%m-%d %T') AS updated_at
+    FROM conversations
+    WHERE id = %s;
+    SELECT id, user_id, role, content, conversation_id,
+           DATE_FORMAT(created_at, '%Y-%m-%d %T') AS created_at
+    FROM chat_history
+    WHERE conversation_id = %s
+    ORDER BY id ASC
+    LIMIT %s
+"""
+
+
+def get_chat_with_messages(chat_id: int, limit: int = 100):
+    """
+    Get a conversation row + its messages in a single multi-statement call
+    Returns (chat, messages) → chat is None if it doesn't exist
+    """
+    with get_conn() as conn:
+        if not conn:
+            return None, []
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+            results = []
+            for result in cursor.execute(CHAT_WITH_MESSAGES_SQL, (chat_id, chat_id, limit), multi=True):
+                if result.with_rows:
+                    results.append(result.fetchall())
+            cursor.close()
+
+            chat_rows, messages = results
+            return (chat_rows[0] if chat_rows else None), messages
+        except Exception as e:
+            print(f"Error fetching chat with messages: {e}")
+            return None, []
 
 
 # ============================================
@@ -139,95 +354,212 @@ def get_messages_by_conversation(conversation_id: int, limit: int = 100):
 
 def delete_message_by_id(message_id: int):
     """Delete a single message by its id (admin use)"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM chat_history WHERE id = %s", (message_id,))
-        conn.commit()
-        success = cursor.rowcount > 0
-        cursor.close()
-        return success
-    except Exception as e:
-        print(f"Error deleting message: {e}")
-        return False
-    finally:
-        conn.close()
+    with get_conn() as conn:
+        if not conn:
+            return False
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM chat_history WHERE id = %s", (message_id,))
+            conn.commit()
+            invalidate_sidebar()  # owner unknown here
+            forget_history()
+            success = cursor.rowcount > 0
+            cursor.close()
+            return success
+        except Exception as e:
+            print(f"Error deleting message: {e}")
+            return False
 
 
 def delete_messages_by_conversation(conversation_id: int):
     """Delete ALL messages of a conversation (used when deleting a chat)"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM chat_history WHERE conversation_id = %s", (conversation_id,))
-        conn.commit()
-        deleted_count = cursor.rowcount
-        cursor.close()
-        return deleted_count
-    except Exception as e:
-        print(f"Error deleting conversation messages: {e}")
-        return False
-    finally:
-        conn.close()
+    with get_conn() as conn:
+        if not conn:
+            return False
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM chat_history WHERE conversation_id = %s", (conversation_id,))
+            conn.commit()
+            invalidate_sidebar(conversation_id=conversation_id)
+            forget_history(conversation_id)
+            deleted_count = cursor.rowcount
+            cursor.close()
+            return deleted_count
+        except Exception as e:
+            print(f"Error deleting conversation messages: {e}")
+            return False
+
+
+def delete_messages_by_ids(ids: list, conversation_id: int = None):
+    """
+    Delete several messages with ONE statement (instead of a delete_message_by_id loop)
+    conversation_id → only ids inside that conversation are touched
+    Returns number of deleted rows, False on error
+    """
+    if not ids:
+        return 0
+
+    placeholders = ", ".join(["%s"] * len(ids))
+    query = f"DELETE FROM chat_history WHERE id IN ({placeholders})"
+    params = list(ids)
+    if conversation_id is not None:
+        query += " AND conversation_id = %s"
+        params.append(conversation_id)
+
+    with get_conn() as conn:
+        if not conn:
+            return False
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            conn.commit()
+            invalidate_sidebar(conversation_id=conversation_id)
+            forget_history(conversation_id)
+            deleted_count = cursor.rowcount
+            cursor.close()
+            return deleted_count
+        except Exception as e:
+            print(f"Error deleting messages: {e}")
+            return False
 
 
 # ============================================
 # ADMIN: GET ALL MESSAGES (with filters)
 # ============================================
 
-def get_all_messages(user_id: str = None, role: str = None, conversation_id: int = None, page: int = 1, limit: int = 20):
+@lru_cache(maxsize=32)
+def _all_messages_sql(has_user: bool, has_role: bool, has_conversation: bool):
     """
-    Admin use: get messages with optional filters + pagination
+    (page_sql, count_sql) for one filter combination — built once, then reused
+    Page + total in one statement: COUNT(*) OVER () sees every filtered row
+    before LIMIT; the window runs on ids only, content is read just for the page
     """
-    conn = get_db_connection()
-    if not conn:
-        return [], 0
-
-    try:
-        cursor = conn.cursor(dictionary=True)
-
-        # Build dynamic WHERE clause
-        conditions = []
-        params = []
-
-        if user_id:
-            conditions.append("user_id = %s")
-            params.append(user_id)
-        if role:
-            conditions.append("role = %s")
-            params.append(role)
-        if conversation_id:
-            conditions.append("conversation_id = %s")
-            params.append(conversation_id)
-
-        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
-
-        # Get total count
-        count_query = f"SELECT COUNT(*) as total FROM chat_history{where_clause}"
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-
-        # Get paginated data
-        offset = (page - 1) * limit
-        data_query = f"""
-            SELECT id, user_id, role, content, conversation_id, created_at
+    conditions = [
+        condition for condition, enabled in (
+            ("user_id = %s", has_user),
+            ("role = %s", has_role),
+            ("conversation_id = %s", has_conversation)
+        ) if enabled
+    ]
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    page_sql = f"""
+        SELECT ch.id, ch.user_id, ch.role, ch.content, ch.conversation_id,
+               DATE_FORMAT(ch.created_at, '%Y-%m-%d %T') AS created_at,
+               p.total
+        FROM (
+            SELECT id, COUNT(*) OVER () AS total
             FROM chat_history{where_clause}
             ORDER BY id DESC
             LIMIT %s OFFSET %s
-        """
-        cursor.execute(data_query, params + [limit, offset])
-        messages = cursor.fetchall()
-
-        cursor.close()
-        return messages, total
-    except Exception as e:
-        print(f"Error fetching all messages: {e}")
-        return [], 0
-    finally:
-        conn.close()
\ No newline at end of file
+        ) p
+        JOIN chat_history ch ON ch.id = p.id
+        ORDER BY ch.id DESC
+    """
+    count_sql = f"SELECT COUNT(*) as total FROM chat_history{where_clause}"
+    return page_sql, count_sql
+
+
+def get_all_messages(user_id: str = None, role: str = None, conversation_id: int = None, page: int = 1, limit: int = 20):
+    """
+    Admin use: get messages with optional filters + pagination
+    """
+    with get_conn() as conn:
+        if not conn:
+            return [], 0
+
+        try:
+            cursor = conn.cursor(dictionary=True)
+
+            page_sql, count_sql = _all_messages_sql(bool(user_id), bool(role), bool(conversation_id))
+            params = tuple(value for value in (user_id, role, conversation_id) if value)
+
+            offset = (page - 1) * limit
+            cursor.execute(page_sql, params + (limit, offset))
+            messages, total = pop_window_total(cursor.fetchall())
+
+            if total is None:
+                # Page past the end → no row to carry the total
+                cursor.execute(count_sql, params)
+                total = cursor.fetchone()['total']
+
+            cursor.close()
+            return messages, total
+        except Exception as e:
+            print(f"Error fetching all messages: {e}")
+            return [], 0
+
+# ============================================
+# UPLOADED DOCUMENTS (vector index source of truth)
+# ============================================
+
+INSERT_DOCUMENT_SQL = """
+    INSERT INTO conversation_documents (conversation_id, filename, content)
+    VALUES (%s, %s, %s)
+"""
+
+SELECT_DOCUMENT_IDS_SQL = """
+    SELECT id FROM conversation_documents
+    WHERE conversation_id = %s
+"""
+
+
+def store_document(conversation_id: int, filename: str, content: str):
+    """Persist an upload's extracted text, returns the document id (None on failure)"""
+    with get_conn() as conn:
+        if not conn:
+            print("Skipping store_document: No database connection.")
+            return None
+
+        try:
+            cursor = prepared_cursor(conn, INSERT_DOCUMENT_SQL)
+            cursor.execute(INSERT_DOCUMENT_SQL, (conversation_id, filename, content))
+            conn.commit()
+            return cursor.lastrowid
+        except Exception as e:
+            print(f"Error storing document: {e}")
+            drop_prepared_cursors(conn)
+            return None
+
+
+def get_document_ids(conversation_id: int):
+    """Ids of every document uploaded to this conversation (index-only read), None on failure"""
+    with get_conn() as conn:
+        if not conn:
+            return None
+
+        try:
+            cursor = prepared_cursor(conn, SELECT_DOCUMENT_IDS_SQL)
+            cursor.execute(SELECT_DOCUMENT_IDS_SQL, (conversation_id,))
+            return {document_id for (document_id,) in cursor.fetchall()}
+        except Exception as e:
+            print(f"Error fetching document ids: {e}")
+            drop_prepared_cursors(conn)
+            return None
+
+
+def get_documents(ids: list):
+    """[(id, conversation_id, filename, content)] for the given document ids"""
+    if not ids:
+        return []
+
+    with get_conn() as conn:
+        if not conn:
+            return []
+
+        try:
+            cursor = conn.cursor()
+            placeholders = ", ".join(["%s"] * len(ids))
+            cursor.execute(
+                f"SELECT id, conversation_id, filename, content FROM conversation_documents WHERE id IN ({placeholders})",
+                tuple(ids)
+            )
+            documents = cursor.fetchall()
+            cursor.close()
+            return documents
+        except Exception as e:
+            print(f"Error fetching documents: {e}")
+            return []
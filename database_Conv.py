@@ -3,30 +3,147 @@ database_Conv.py
 Handles ALL conversations table operations ONLY
 """
 
-import mysql.connector
 from mysql.connector import Error
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+import db_common
+from db_common import (
+    release_connection, open_cursor, pop_window_total,
+    cached_conversation, remember_conversation, cached_active, remember_active,
+    forget_conversation, forget_user_conversations,
+    cached_sidebar, remember_sidebar, invalidate_sidebar,
+    record_history, forget_history
+)
+from document_index import forget_documents
 
 # ============================================
 # CONNECTION
 # ============================================
 
+POOL_NAME = "conv"
+
+
 def get_db_connection():
-    try:
-        return mysql.connector.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            port=24253,
-            user=os.getenv("DB_USER", "root"),
-            password=os.getenv("DB_PASSWORD", ""),
-            database=os.getenv("DB_NAME", "chatbot_db"),
-            connect_timeout=5
+    """Borrow a connection from the conversations pool (db_common.get_db_connection)"""
+    return db_common.get_db_connection(POOL_NAME)
+
+
+# ============================================
+# QUERIES
+# ============================================
+
+# Timestamps are formatted by MySQL so rows are JSON-ready as fetched
+CONVERSATION_BY_ID_SQL = """
+    SELECT
+        id,
+        user_id,
+        label,
+        is_active,
+        DATE_FORMAT(created_at, '%Y-%m-%d %T') AS created_at,
+        DATE_FORMAT(updated_at, '%Y-%m-%d %T') AS updated_at
+    FROM conversations
+    WHERE id = %s
+"""
+
+# Fixed statements → prepared once per pooled connection (open_cursor)
+# Callers (/chat, /upload) only read id + label; ix_conv_uid_active_created serves filter + order
+ACTIVE_CONVERSATION_SQL = """
+    SELECT id, label FROM conversations
+    WHERE user_id = %s AND is_active = TRUE
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+
+ACTIVATE_CONVERSATION_SQL = "UPDATE conversations SET is_active = TRUE, updated_at = NOW() WHERE id = %s AND user_id = %s"
+DEACTIVATE_OTHERS_SQL = "UPDATE conversations SET is_active = FALSE, updated_at = NOW() WHERE user_id = %s AND id <> %s"
+RENAME_CONVERSATION_SQL = "UPDATE conversations SET label = %s, updated_at = NOW() WHERE id = %s"
+ARCHIVE_CONVERSATION_SQL = "UPDATE conversations SET is_active = FALSE, updated_at = NOW() WHERE id = %s"
+DELETE_CONVERSATION_SQL = "DELETE FROM conversations WHERE id = %s"
+LABEL_IF_DEFAULT_SQL = "UPDATE conversations SET label = %s, updated_at = NOW() WHERE id = %s AND label = 'New Chat'"
+
+
+def conversation_list_sql(where_clause: str, with_total: bool = False):
+    """
+    One page of conversations + message_count + last_message preview
+    The page is cut first, then chat_history is read once for just those chats:
+    COUNT/ROW_NUMBER windows run on (conversation_id, id) only, content is
+    fetched for the single last row of each chat
+    with_total → every row also carries total (COUNT(*) OVER () of the filter, before LIMIT)
+    Params: where params..., limit, offset
+    """
+    total_column = ", COUNT(*) OVER () AS total" if with_total else ""
+    total_select = ",\n            p.total" if with_total else ""
+    return f"""
+        WITH page AS (
+            SELECT c.id, c.user_id, c.label, c.is_active, c.created_at, c.updated_at{total_column}
+            FROM conversations c
+            {where_clause}
+            ORDER BY c.updated_at DESC, c.id DESC
+            LIMIT %s OFFSET %s
+        ),
+        msg AS (
+            SELECT
+                ch.conversation_id,
+                ch.id,
+                COUNT(*) OVER (PARTITION BY ch.conversation_id) AS message_count,
+                ROW_NUMBER() OVER (PARTITION BY ch.conversation_id ORDER BY ch.id DESC) AS rn
+            FROM chat_history ch
+            JOIN page p ON p.id = ch.conversation_id
         )
-    except Exception as e:
-        print(f"DATABASE CONNECTION ERROR: {e}")
-        return None
+        SELECT
+            p.id,
+            p.user_id,
+            p.label,
+            p.is_active,
+            DATE_FORMAT(p.created_at, '%Y-%m-%d %T') AS created_at,
+            DATE_FORMAT(p.updated_at, '%Y-%m-%d %T') AS updated_at,
+            COALESCE(m.message_count, 0) AS message_count,
+            SUBSTRING(lm.content, 1, 80) AS last_message{total_select}
+        FROM page p
+        LEFT JOIN msg m ON m.conversation_id = p.id AND m.rn = 1
+        LEFT JOIN chat_history lm ON lm.id = m.id
+        ORDER BY p.updated_at DESC, p.id DESC
+    """
+
+
+# Keyset (seek) pagination over ORDER BY updated_at DESC, id DESC
+KEYSET_CONDITION = "(c.updated_at < %s OR (c.updated_at = %s AND c.id < %s))"
+
+
+def keyset_params(before: tuple):
+    """(updated_at, id) of the last row seen → params for KEYSET_CONDITION"""
+    updated_at, last_id = before
+    return [updated_at, updated_at, last_id]
+
+
+def encode_cursor(row: dict):
+    """Opaque next-page cursor from the last row of a page"""
+    return f"{row['updated_at']},{row['id']}"
+
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor → (updated_at, id), raises ValueError if malformed"""
+    updated_at, _, last_id = cursor.rpartition(",")
+    if not updated_at:
+        raise ValueError("Invalid cursor")
+    return updated_at, int(last_id)
+
+
+# InnoDB FULLTEXT ignores tokens shorter than innodb_ft_min_token_size (3)
+FT_MIN_TOKEN = 3
+
+
+def label_search_clause(keyword: str):
+    """
+    WHERE fragment + param for a label search
+    Uses the ft_label FULLTEXT index (every word, prefix match)
+    Falls back to LIKE when a word is too short to be in the index
+    """
+    words = [w for w in re.split(r'[\s+\-<>()~*"@]+', keyword) if w]
+    if words and all(len(w) >= FT_MIN_TOKEN for w in words):
+        return "MATCH(c.label) AGAINST (%s IN BOOLEAN MODE)", " ".join(f"+{w}*" for w in words)
+    return "c.label LIKE %s", f"%{keyword}%"
 
 
 # ============================================
@@ -35,7 +152,7 @@ def get_db_connection():
 
 def get_active_conversation(user_id: str):
     """
-    Get the current active conversation for a user
+    Get the current active conversation for a user → {id, label}
     Returns None if no active conversation exists
     """
     conn = get_db_connection()
@@ -43,22 +160,15 @@ def get_active_conversation(user_id: str):
         return None
 
     try:
-        cursor = conn.cursor(dictionary=True)
-        query = """
-            SELECT * FROM conversations
-            WHERE user_id = %s AND is_active = TRUE
-            ORDER BY created_at DESC
-            LIMIT 1
-        """
-        cursor.execute(query, (user_id,))
-        conversation = cursor.fetchone()
-        cursor.close()
-        return conversation
+        with open_cursor(conn, ACTIVE_CONVERSATION_SQL) as cursor:
+            cursor.execute(ACTIVE_CONVERSATION_SQL, (user_id,))
+            rows = cursor.fetchall()
+        return rows[0] if rows else None
     except Error as e:
         print(f"Error fetching active conversation: {e}")
         return None
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
@@ -70,15 +180,57 @@ def ensure_active_conversation(user_id: str):
     Makes sure user always has an active conversation
     If none exists → creates one automatically
     Called before every /chat and /upload request
+    Cached per user for 30s (dropped on create/switch/rename/archive/delete)
     """
+    cached = cached_active(user_id)
+    if cached is not None:
+        return cached
+
     active = get_active_conversation(user_id)
 
     if not active:
         active = create_conversation(user_id=user_id, label="New Chat")
 
+    if active:
+        remember_active(user_id, active)
+        return dict(active)
     return active
 
 
+# ============================================
+# ENSURE ACTIVE CONVERSATION + STORE MESSAGE (one round-trip)
+# ============================================
+
+def ensure_and_store_message(user_id: str, role: str, content: str):
+    """
+    ensure_and_store procedure (migrations/006):
+    finds or creates the active conversation AND inserts the message
+    Returns (conversation {id, label}, message_id), (None, None) on failure
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None, None
+
+    try:
+        cursor = conn.cursor()
+        result = cursor.callproc("ensure_and_store", (user_id, role, content, 0, "", 0))
+        conn.commit()
+        invalidate_sidebar(user_id)
+
+        conversation_id, label, message_id = result[3:]
+        cursor.close()
+        conversation = {"id": int(conversation_id), "label": label}
+        remember_active(user_id, conversation)
+        record_history(user_id, conversation["id"], int(message_id), role, content)
+        return dict(conversation), int(message_id)
+    except Error as e:
+        print(f"Error in ensure_and_store: {e}")
+        conn.rollback()
+        return None, None
+    finally:
+        release_connection(conn)
+
+
 # ============================================
 # CREATE CONVERSATION
 # ============================================
@@ -93,83 +245,145 @@ def create_conversation(user_id: str, label: str = "New Chat"):
         return None
 
     try:
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor()
+
+        # Stamped here in UTC (the session time_zone) and used for both
+        # statements → the new row is known without reading it back
+        # (same shape as CONVERSATION_BY_ID_SQL)
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
         # Deactivate all existing conversations for this user
         cursor.execute(
-            "UPDATE conversations SET is_active = FALSE, updated_at = NOW() WHERE user_id = %s AND is_active = TRUE",
-            (user_id,)
+            "UPDATE conversations SET is_active = FALSE, updated_at = %s WHERE user_id = %s AND is_active = TRUE",
+            (now, user_id)
         )
 
         # Insert new conversation
         cursor.execute(
-            "INSERT INTO conversations (user_id, label, is_active) VALUES (%s, %s, TRUE)",
-            (user_id, label)
+            "INSERT INTO conversations (user_id, label, is_active, created_at, updated_at) VALUES (%s, %s, TRUE, %s, %s)",
+            (user_id, label, now, now)
         )
-        conn.commit()
-
-        # Fetch and return the new conversation
         new_id = cursor.lastrowid
-        cursor.execute("SELECT * FROM conversations WHERE id = %s", (new_id,))
-        new_conversation = cursor.fetchone()
+        conn.commit()
+        forget_user_conversations(user_id)
+        invalidate_sidebar(user_id)
 
         cursor.close()
-        return new_conversation
+        return {
+            "id": new_id,
+            "user_id": user_id,
+            "label": label,
+            "is_active": 1,
+            "created_at": now,
+            "updated_at": now
+        }
     except Error as e:
         print(f"Error creating conversation: {e}")
         return None
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
 # GET ALL CONVERSATIONS (for sidebar)
 # ============================================
 
-def get_all_conversations(user_id: str, limit: int = 50):
+def get_all_conversations(user_id: str, limit: int = 50, before: tuple = None):
     """
     Get all conversations for a user
     Includes last message preview and message count
     Sorted by updated_at DESC (most recent first)
+    before → keyset page: (updated_at, id) of the last row already seen
+    Cached for a few seconds per (user_id, limit, before)
     """
+    cache_key = (user_id, limit, before)
+    cached = cached_sidebar(cache_key)
+    if cached is not None:
+        return cached
+
     conn = get_db_connection()
     if not conn:
         return []
 
     try:
-        cursor = conn.cursor(dictionary=True)
-        query = """
-            SELECT
-                c.id,
-                c.user_id,
-                c.label,
-                c.is_active,
-                c.created_at,
-                c.updated_at,
-                COUNT(ch.id) as message_count,
-                (
-                    SELECT SUBSTRING(ch2.content, 1, 80)
-                    FROM chat_history ch2
-                    WHERE ch2.conversation_id = c.id
-                    ORDER BY ch2.id DESC
-                    LIMIT 1
-                ) as last_message
-            FROM conversations c
-            LEFT JOIN chat_history ch ON ch.conversation_id = c.id
-            WHERE c.user_id = %s
-            GROUP BY c.id
-            ORDER BY c.updated_at DESC
-            LIMIT %s
-        """
-        cursor.execute(query, (user_id, limit))
-        conversations = cursor.fetchall()
+        cursor = conn.cursor()  # tuple rows, zipped with the column names once below
+
+        params = [user_id]
+        keyset_clause = ""
+        if before:
+            keyset_clause = f" AND {KEYSET_CONDITION}"
+            params.extend(keyset_params(before))
+
+        query = conversation_list_sql(f"WHERE c.user_id = %s{keyset_clause}")
+        cursor.execute(query, params + [limit, 0])
+        columns = cursor.column_names
+        conversations = [dict(zip(columns, row)) for row in cursor.fetchall()]
         cursor.close()
+
+        remember_sidebar(cache_key, conversations)
         return conversations
     except Error as e:
         print(f"Error fetching conversations: {e}")
         return []
     finally:
-        conn.close()
+        release_connection(conn)
+
+
+# ============================================
+# LIST FINGERPRINT (ETag)
+# ============================================
+
+def get_conversations_fingerprint(user_id: str = None, is_active: bool = None):
+    """
+    Cheap change marker for a conversation list → used as the ETag source
+    (last updated_at, chat count, newest chat id, sum of revisions,
+     newest message id, message count)
+    Conversations are read from ix_conv_fingerprint — migrations/008 bumps revision
+    on every row update; messages from the user's ix_ch_uid_role_id range
+    (is_active isn't applied to messages → a superset, never a stale ETag)
+    Returns None on error → caller just skips the 304 shortcut
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        cursor = conn.cursor()
+
+        conditions = []
+        params = []
+
+        if user_id:
+            conditions.append("c.user_id = %s")
+            params.append(user_id)
+        if is_active is not None:
+            conditions.append("c.is_active = %s")
+            params.append(is_active)
+
+        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+        history_where = " WHERE ch.user_id = %s" if user_id else ""
+        if user_id:
+            params.append(user_id)
+
+        cursor.execute(f"""
+            SELECT conv.*, msg.*
+            FROM (
+                SELECT MAX(c.updated_at) AS updated_at, COUNT(*) AS chats, MAX(c.id) AS chat_id, SUM(c.revision) AS revisions
+                FROM conversations c{where_clause}
+            ) conv
+            CROSS JOIN (
+                SELECT MAX(ch.id) AS message_id, COUNT(*) AS messages
+                FROM chat_history ch{history_where}
+            ) msg
+        """, params)
+        fingerprint = cursor.fetchone()
+        cursor.close()
+        return fingerprint
+    except Error as e:
+        print(f"Error fetching conversations fingerprint: {e}")
+        return None
+    finally:
+        release_connection(conn)
 
 
 # ============================================
@@ -177,22 +391,33 @@ def get_all_conversations(user_id: str, limit: int = 50):
 # ============================================
 
 def get_conversation_by_id(conversation_id: int):
-    """Get a single conversation by id"""
+    """
+    Get a single conversation by id
+    Served from a 5s TTL cache when possible (invalidated on every write)
+    """
+    cached = cached_conversation(conversation_id)
+    if cached is not None:
+        return cached
+
     conn = get_db_connection()
     if not conn:
         return None
 
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM conversations WHERE id = %s", (conversation_id,))
-        conversation = cursor.fetchone()
-        cursor.close()
+        with open_cursor(conn, CONVERSATION_BY_ID_SQL) as cursor:
+            cursor.execute(CONVERSATION_BY_ID_SQL, (conversation_id,))
+            rows = cursor.fetchall()
+        conversation = rows[0] if rows else None
+
+        if conversation:
+            remember_conversation(conversation_id, conversation)
+            return dict(conversation)
         return conversation
     except Error as e:
         print(f"Error fetching conversation: {e}")
         return None
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
@@ -202,37 +427,35 @@ def get_conversation_by_id(conversation_id: int):
 def switch_conversation(user_id: str, conversation_id: int):
     """
     User clicks an old chat in sidebar
-    → Deactivates all other conversations
     → Sets this one as active
+    → Deactivates all other conversations
+    One transaction: returns rows activated (0 → not found / not this user's), False on error
     """
     conn = get_db_connection()
     if not conn:
         return False
 
     try:
-        cursor = conn.cursor()
-
-        # Deactivate all for this user
-        cursor.execute(
-            "UPDATE conversations SET is_active = FALSE, updated_at = NOW() WHERE user_id = %s",
-            (user_id,)
-        )
-
-        # Activate the selected one
-        cursor.execute(
-            "UPDATE conversations SET is_active = TRUE, updated_at = NOW() WHERE id = %s AND user_id = %s",
-            (conversation_id, user_id)
-        )
+        # Activate the selected one (only if it belongs to this user)
+        with open_cursor(conn, ACTIVATE_CONVERSATION_SQL, dictionary=False) as cursor:
+            cursor.execute(ACTIVATE_CONVERSATION_SQL, (conversation_id, user_id))
+            activated = cursor.rowcount
+        if not activated:
+            conn.rollback()
+            return 0
+
+        # Deactivate all others for this user
+        with open_cursor(conn, DEACTIVATE_OTHERS_SQL, dictionary=False) as cursor:
+            cursor.execute(DEACTIVATE_OTHERS_SQL, (user_id, conversation_id))
         conn.commit()
-
-        success = cursor.rowcount > 0
-        cursor.close()
-        return success
+        forget_user_conversations(user_id)
+        invalidate_sidebar(user_id)
+        return activated
     except Error as e:
         print(f"Error switching conversation: {e}")
         return False
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
@@ -240,26 +463,27 @@ def switch_conversation(user_id: str, conversation_id: int):
 # ============================================
 
 def update_conversation_label(conversation_id: int, new_label: str):
-    """Update label/title of a conversation"""
+    """
+    Update label/title of a conversation
+    Returns rows matched (0 → not found), False on error
+    """
     conn = get_db_connection()
     if not conn:
         return False
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE conversations SET label = %s, updated_at = NOW() WHERE id = %s",
-            (new_label, conversation_id)
-        )
+        with open_cursor(conn, RENAME_CONVERSATION_SQL, dictionary=False) as cursor:
+            cursor.execute(RENAME_CONVERSATION_SQL, (new_label, conversation_id))
+            updated_count = cursor.rowcount
         conn.commit()
-        success = cursor.rowcount > 0
-        cursor.close()
-        return success
+        invalidate_sidebar(conversation_id=conversation_id)
+        forget_conversation(conversation_id)
+        return updated_count
     except Error as e:
         print(f"Error updating label: {e}")
         return False
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
@@ -267,26 +491,27 @@ def update_conversation_label(conversation_id: int, new_label: str):
 # ============================================
 
 def archive_conversation(conversation_id: int):
-    """Archive/close a conversation → sets is_active = FALSE"""
+    """
+    Archive/close a conversation → sets is_active = FALSE
+    Returns rows matched (0 → not found), False on error
+    """
     conn = get_db_connection()
     if not conn:
         return False
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE conversations SET is_active = FALSE, updated_at = NOW() WHERE id = %s",
-            (conversation_id,)
-        )
+        with open_cursor(conn, ARCHIVE_CONVERSATION_SQL, dictionary=False) as cursor:
+            cursor.execute(ARCHIVE_CONVERSATION_SQL, (conversation_id,))
+            archived_count = cursor.rowcount
         conn.commit()
-        success = cursor.rowcount > 0
-        cursor.close()
-        return success
+        invalidate_sidebar(conversation_id=conversation_id)
+        forget_conversation(conversation_id)
+        return archived_count
     except Error as e:
         print(f"Error archiving conversation: {e}")
         return False
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
@@ -295,26 +520,28 @@ def archive_conversation(conversation_id: int):
 
 def delete_conversation(conversation_id: int):
     """
-    Delete a conversation record only
-    Messages are deleted separately via ON DELETE CASCADE
-    or explicitly in the API layer
+    Delete a conversation — its messages go with it via ON DELETE CASCADE
+    Returns number of deleted rows (0 → not found), False on error
     """
     conn = get_db_connection()
     if not conn:
         return False
 
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM conversations WHERE id = %s", (conversation_id,))
+        with open_cursor(conn, DELETE_CONVERSATION_SQL, dictionary=False) as cursor:
+            cursor.execute(DELETE_CONVERSATION_SQL, (conversation_id,))
+            deleted_count = cursor.rowcount
         conn.commit()
-        success = cursor.rowcount > 0
-        cursor.close()
-        return success
+        invalidate_sidebar(conversation_id=conversation_id)
+        forget_conversation(conversation_id)
+        forget_history(conversation_id)
+        forget_documents(conversation_id)
+        return deleted_count
     except Error as e:
         print(f"Error deleting conversation: {e}")
         return False
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
@@ -331,31 +558,47 @@ def update_label_if_default(conversation_id: int, new_label: str):
         return False
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE conversations SET label = %s, updated_at = NOW() WHERE id = %s AND label = 'New Chat'",
-            (new_label, conversation_id)
-        )
+        with open_cursor(conn, LABEL_IF_DEFAULT_SQL, dictionary=False) as cursor:
+            cursor.execute(LABEL_IF_DEFAULT_SQL, (new_label, conversation_id))
+            updated = cursor.rowcount > 0
         conn.commit()
-        updated = cursor.rowcount > 0
-        cursor.close()
+        invalidate_sidebar(conversation_id=conversation_id)
+        forget_conversation(conversation_id)
         return updated
     except Error as e:
         print(f"Error updating default label: {e}")
         return False
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
 # ADMIN: GET ALL CONVERSATIONS (all users)
 # ============================================
 
-def get_all_conversations_admin(user_id: str = None, is_active: bool = None, page: int = 1, limit: int = 20):
+@lru_cache(maxsize=16)
+def _admin_list_sql(has_user: bool, has_active: bool, keyset: bool):
+    """(page_sql, count_sql) for one admin filter combination — built once, then reused"""
+    conditions = [
+        condition for condition, enabled in (
+            ("c.user_id = %s", has_user),
+            ("c.is_active = %s", has_active)
+        ) if enabled
+    ]
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    page_where = " WHERE " + " AND ".join(conditions + [KEYSET_CONDITION]) if keyset else where_clause
+
+    # Keyset page → the window would only see rows after the cursor, count separately
+    page_sql = conversation_list_sql(page_where, with_total=not keyset)
+    count_sql = f"SELECT COUNT(*) as total FROM conversations c{where_clause}"
+    return page_sql, count_sql
+
+
+def get_all_conversations_admin(user_id: str = None, is_active: bool = None, page: int = 1, limit: int = 20, before: tuple = None):
     """
     Admin: get all conversations across all users
     Optional filters: user_id, is_active
-    Paginated
+    Paginated → by page (OFFSET) or, when before is given, keyset on (updated_at, id)
     """
     conn = get_db_connection()
     if not conn:
@@ -364,49 +607,26 @@ def get_all_conversations_admin(user_id: str = None, is_active: bool = None, pag
     try:
         cursor = conn.cursor(dictionary=True)
 
-        conditions = []
-        params = []
+        page_sql, count_sql = _admin_list_sql(bool(user_id), is_active is not None, bool(before))
+        params = tuple(value for value in (user_id or None, is_active) if value is not None)
 
-        if user_id:
-            conditions.append("c.user_id = %s")
-            params.append(user_id)
-        if is_active is not None:
-            conditions.append("c.is_active = %s")
-            params.append(is_active)
+        # Keyset (seek) page → constant cost no matter how deep
+        if before:
+            page_params = params + tuple(keyset_params(before))
+            offset = 0
+        else:
+            page_params = params
+            offset = (page - 1) * limit
 
-        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+        # Paginated data with message count + last message (+ total in the same pass)
+        cursor.execute(page_sql, page_params + (limit, offset))
+        rows = cursor.fetchall()
+        conversations, total = (rows, None) if before else pop_window_total(rows)
 
-        # Total count
-        cursor.execute(f"SELECT COUNT(*) as total FROM conversations c{where_clause}", params)
-        total = cursor.fetchone()['total']
-
-        # Paginated data with message count + last message
-        offset = (page - 1) * limit
-        query = f"""
-            SELECT
-                c.id,
-                c.user_id,
-                c.label,
-                c.is_active,
-                c.created_at,
-                c.updated_at,
-                COUNT(ch.id) as message_count,
-                (
-                    SELECT SUBSTRING(ch2.content, 1, 80)
-                    FROM chat_history ch2
-                    WHERE ch2.conversation_id = c.id
-                    ORDER BY ch2.id DESC
-                    LIMIT 1
-                ) as last_message
-            FROM conversations c
-            LEFT JOIN chat_history ch ON ch.conversation_id = c.id
-            {where_clause}
-            GROUP BY c.id
-            ORDER BY c.updated_at DESC
-            LIMIT %s OFFSET %s
-        """
-        cursor.execute(query, params + [limit, offset])
-        conversations = cursor.fetchall()
+        # Keyset page or empty page → plain count
+        if total is None:
+            cursor.execute(count_sql, params)
+            total = cursor.fetchone()['total']
 
         cursor.close()
         return conversations, total
@@ -414,15 +634,18 @@ def get_all_conversations_admin(user_id: str = None, is_active: bool = None, pag
         print(f"Error fetching admin conversations: {e}")
         return [], 0
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 # ============================================
 # ADMIN: SEARCH CONVERSATIONS BY LABEL
 # ============================================
 
-def search_conversations_by_label(keyword: str, page: int = 1, limit: int = 20):
-    """Admin: search conversations by label keyword"""
+def search_conversations_by_label(keyword: str, page: int = 1, limit: int = 20, before: tuple = None):
+    """
+    Admin: search conversations by label keyword
+    Paginated → by page (OFFSET) or, when before is given, keyset on (updated_at, id)
+    """
     conn = get_db_connection()
     if not conn:
         return [], 0
@@ -430,35 +653,46 @@ def search_conversations_by_label(keyword: str, page: int = 1, limit: int = 20):
     try:
         cursor = conn.cursor(dictionary=True)
 
-        search_pattern = f"%{keyword}%"
+        search_clause, search_param = label_search_clause(keyword)
 
-        # Total count
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM conversations WHERE label LIKE %s",
-            (search_pattern,)
-        )
-        total = cursor.fetchone()['total']
-
-        # Paginated results
+        # Paginated results (keyset when before is given)
+        params = [search_param]
+        keyset_clause = ""
         offset = (page - 1) * limit
-        query = """
+        if before:
+            keyset_clause = f" AND {KEYSET_CONDITION}"
+            params.extend(keyset_params(before))
+            offset = 0
+
+        # Total rides along as COUNT(*) OVER () — applied after GROUP BY, before LIMIT
+        total_column = "" if before else ",\n                COUNT(*) OVER () AS total"
+        query = f"""
             SELECT
                 c.id,
                 c.user_id,
                 c.label,
                 c.is_active,
-                c.created_at,
-                c.updated_at,
-                COUNT(ch.id) as message_count
+                DATE_FORMAT(c.created_at, '%Y-%m-%d %T') AS created_at,
+                DATE_FORMAT(c.updated_at, '%Y-%m-%d %T') AS updated_at,
+                COUNT(ch.id) as message_count{total_column}
             FROM conversations c
             LEFT JOIN chat_history ch ON ch.conversation_id = c.id
-            WHERE c.label LIKE %s
+            WHERE {search_clause}{keyset_clause}
             GROUP BY c.id
-            ORDER BY c.updated_at DESC
+            ORDER BY c.updated_at DESC, c.id DESC
             LIMIT %s OFFSET %s
         """
-        cursor.execute(query, (search_pattern, limit, offset))
-        conversations = cursor.fetchall()
+        cursor.execute(query, params + [limit, offset])
+        rows = cursor.fetchall()
+        conversations, total = (rows, None) if before else pop_window_total(rows)
+
+        # Keyset page (window only sees rows after the cursor) or empty page → plain count
+        if total is None:
+            cursor.execute(
+                f"SELECT COUNT(*) as total FROM conversations c WHERE {search_clause}",
+                (search_param,)
+            )
+            total = cursor.fetchone()['total']
 
         cursor.close()
         return conversations, total
@@ -466,4 +700,4 @@ def search_conversations_by_label(keyword: str, page: int = 1, limit: int = 20):
         print(f"Error searching conversations: {e}")
         return [], 0
     finally:
-        conn.close()
\ No newline at end of file
+        release_connection(conn)
\ No newline at end of file
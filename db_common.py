@@ -0,0 +1,469 @@
+"""
+db_common.py
+Shared by database.py (chat_history) and database_Conv.py (conversations):
+connection pools, prepared statements, the write-invalidated caches
+"""
+
+import mysql.connector
+from mysql.connector import HAVE_CEXT, pooling
+from mysql.connector.errors import PoolError
+from mysql.connector.constants import ClientFlag
+import os
+import sys
+import json
+import multiprocessing
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================================
+# CONNECTION POOLS
+# ============================================
+
+# pool name → MySQLConnectionPool ("chatbot" → database.py, "conv" → database_Conv.py)
+_POOLS = {}
+_POOL_LOCK = threading.Lock()
+_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "25"))
+
+# Pool exhausted (the AnyIO threadpool is far larger) → at most this many extra
+# direct connections per pool, then borrowers wait up to DB_POOL_TIMEOUT seconds
+# for a free one → server connections stay bounded under load
+_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+_POOL_RETRY_DELAY = 0.05
+
+# pool name → semaphore counting its free overflow slots
+_OVERFLOW = {}
+
+
+# Read once at import → every pool/connect call reuses the same kwargs
+_DB_CFG = dict(
+    host=os.getenv("DB_HOST", "localhost"),
+    port=24253,
+    user=os.getenv("DB_USER", "root"),
+    password=os.getenv("DB_PASSWORD", ""),
+    database=os.getenv("DB_NAME", "chatbot_db"),
+    connect_timeout=5,
+    autocommit=False,
+    # NOW() / TIMESTAMP columns in UTC → matches the app-side stamps (create_conversation)
+    time_zone="+00:00",
+    # C extension (libmysqlclient) parses rows/binds params natively
+    use_pure=not HAVE_CEXT,
+    # rowcount = rows matched, not rows changed → 0 always means "not found"
+    client_flags=[ClientFlag.FOUND_ROWS]
+)
+
+
+if not HAVE_CEXT:
+    print("WARNING: mysql-connector C extension not available, using the pure-Python driver")
+
+
+def _get_pool(pool_name: str):
+    """
+    Create the named pool on first use
+    Lazy so the app still boots when the database is down
+    """
+    pool = _POOLS.get(pool_name)
+    if pool is None:
+        with _POOL_LOCK:
+            pool = _POOLS.get(pool_name)
+            if pool is None:
+                pool = _POOLS[pool_name] = pooling.MySQLConnectionPool(
+                    pool_name=pool_name,
+                    pool_size=_POOL_SIZE,
+                    pool_reset_session=False,
+                    **_DB_CFG
+                )
+                _OVERFLOW[pool_name] = threading.BoundedSemaphore(_MAX_OVERFLOW)
+    return pool
+
+
+def warm_up_pool(pool_name: str):
+    """
+    Open a pool at startup → a bad .env / unreachable DB shows up in the
+    boot log instead of on the first request. Never raises (lazy retry later)
+    """
+    try:
+        _get_pool(pool_name)
+        return True
+    except Exception as e:
+        print(f"DATABASE POOL WARM-UP FAILED ({pool_name}): {e}")
+        return False
+
+
+class _OverflowConnection:
+    """Direct connection opened past the pool size → frees its overflow slot on close()"""
+
+    def __init__(self, conn, slots):
+        self._conn = conn
+        self._slots = slots
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        try:
+            self._conn.close()
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+                self._slots = None
+
+
+def get_db_connection(pool_name: str):
+    """
+    Borrow a connection from the named pool
+    release_connection() hands it back to the pool instead of closing the socket
+    Pool exhausted → a direct connection while overflow slots are left,
+    otherwise wait for one to free up (None after DB_POOL_TIMEOUT)
+    """
+    deadline = time.monotonic() + _POOL_TIMEOUT
+    while True:
+        try:
+            conn = _get_pool(pool_name).get_connection()
+            forget_stale_prepared(conn)
+            return conn
+        except PoolError:
+            pass
+        except Exception as e:
+            print(f"DATABASE CONNECTION ERROR: {e}")
+            return None
+
+        slots = _OVERFLOW[pool_name]
+        if slots.acquire(blocking=False):
+            try:
+                return _OverflowConnection(mysql.connector.connect(**_DB_CFG), slots)
+            except Exception as e:
+                slots.release()
+                print(f"DATABASE CONNECTION ERROR: {e}")
+                return None
+
+        if time.monotonic() >= deadline:
+            print(f"DATABASE POOL EXHAUSTED ({pool_name}): no connection within {_POOL_TIMEOUT}s")
+            return None
+        time.sleep(_POOL_RETRY_DELAY)
+
+
+def release_connection(conn):
+    """
+    Give a borrowed connection back
+    Rolls back first → a read doesn't keep its REPEATABLE READ snapshot (and
+    InnoDB purge) pinned while the connection idles in the pool
+    """
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except Exception as e:
+        # Broken connection → the pool reconnects it on the next borrow
+        print(f"DATABASE ROLLBACK ON RELEASE FAILED: {e}")
+    conn.close()
+
+
+# ============================================
+# PREPARED STATEMENTS
+# ============================================
+
+# (connection_id, sql, dictionary) → prepared cursor
+# Pooled connections live for the whole process, so each statement is parsed
+# by the server once per connection and later calls only bind + execute
+_stmt_cache = {}
+_stmt_lock = threading.Lock()
+
+# id(pooled connection object) → connection_id its cached cursors were prepared on
+# The pool reconnects dead connections in place (new connection_id, same object)
+_stmt_owners = {}
+
+
+def prepared_cursor(conn, sql: str, dictionary: bool = False):
+    """Get (or create) the cached prepared cursor for this connection + SQL"""
+    if not isinstance(conn, pooling.PooledMySQLConnection):
+        # Overflow connection, closed after this call → nothing to reuse
+        return conn.cursor(prepared=True, dictionary=dictionary)
+
+    key = (conn.connection_id, sql, dictionary)
+    with _stmt_lock:
+        cursor = _stmt_cache.get(key)
+    if cursor is None:
+        cursor = conn.cursor(prepared=True, dictionary=dictionary)
+        with _stmt_lock:
+            _stmt_cache[key] = cursor
+    return cursor
+
+
+def drop_prepared_cursors(conn):
+    """Forget cached cursors of a connection after an error (it may have reconnected)"""
+    try:
+        connection_id = conn.connection_id
+    except Exception:
+        return
+    with _stmt_lock:
+        for key in [k for k in _stmt_cache if k[0] == connection_id]:
+            _stmt_cache.pop(key, None)
+
+
+def forget_stale_prepared(conn):
+    """
+    On borrow: if the pool reconnected this connection since its cursors were
+    cached, drop them (their statements died with the old server session)
+    """
+    cnx = getattr(conn, "_cnx", None)
+    if cnx is None:
+        return
+    try:
+        connection_id = conn.connection_id
+    except Exception:
+        return
+    with _stmt_lock:
+        previous = _stmt_owners.get(id(cnx))
+        _stmt_owners[id(cnx)] = connection_id
+        if previous is not None and previous != connection_id:
+            for key in [k for k in _stmt_cache if k[0] == previous]:
+                _stmt_cache.pop(key, None)
+
+
+@contextmanager
+def open_cursor(conn, sql: str = None, dictionary: bool = True):
+    """
+    with open_cursor(conn, SQL) as cursor: cursor.execute(SQL, params)
+    sql given → cached prepared cursor for this connection (stays open for reuse)
+    no sql → plain cursor for dynamic SQL, closed on exit
+    """
+    if sql is None:
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+        return
+
+    try:
+        yield prepared_cursor(conn, sql, dictionary)
+    except Exception:
+        drop_prepared_cursors(conn)
+        raise
+
+
+def pop_window_total(rows: list):
+    """Strip the COUNT(*) OVER () column from a page → (rows, total or None if page is empty)"""
+    if not rows:
+        return rows, None
+    total = rows[0]['total']
+    for row in rows:
+        del row['total']
+    return rows, total
+
+
+# ============================================
+# CONVERSATION CACHE
+# ============================================
+
+def _several_workers():
+    """
+    True unless this process looks like the app's only worker
+    Checks WEB_CONCURRENCY (read by uvicorn and gunicorn), --workers / -w on the
+    command line (or GUNICORN_CMD_ARGS), and a uvicorn supervisor parent
+    (--workers / --reload) whose worker count isn't visible from here
+    gunicorn's config-file `workers` setting can't be seen → set WEB_CONCURRENCY too
+    """
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        return True
+
+    args = sys.argv[1:] + os.getenv("GUNICORN_CMD_ARGS", "").split()
+    for i, arg in enumerate(args):
+        if arg in ("--workers", "-w"):
+            value = args[i + 1] if i + 1 < len(args) else ""
+        elif arg.startswith("--workers="):
+            value = arg.partition("=")[2]
+        elif arg.startswith("-w"):
+            value = arg[2:]
+        else:
+            continue
+        if value.isdigit() and int(value) > 1:
+            return True
+
+    return multiprocessing.parent_process() is not None
+
+
+# Several workers → a write on one worker can't invalidate the others' in-process
+# caches, so the write-invalidated caches below start disabled (TTL 0)
+MULTI_WORKER = _several_workers()
+
+# get_conversation_by_id is the existence check in front of most routes
+# Rows barely change → keep them for a few seconds, drop them on every write
+_conv_cache = TTLCache(maxsize=10_000, ttl=0 if MULTI_WORKER else 5)
+_conv_cache_lock = threading.Lock()
+
+# ensure_active_conversation → user_id: active conversation
+# Chat bursts (turns 2..N, uploads) skip the lookup; same invalidation as above
+# ACTIVE_CACHE_TTL=0 turns it off
+_active_cache = TTLCache(maxsize=5_000, ttl=float(os.getenv("ACTIVE_CACHE_TTL", "0" if MULTI_WORKER else "30")))
+
+
+def cached_conversation(conversation_id: int):
+    """Copy of the cached conversation row, None on a miss"""
+    with _conv_cache_lock:
+        cached = _conv_cache.get(conversation_id)
+    return dict(cached) if cached is not None else None
+
+
+def remember_conversation(conversation_id: int, conversation: dict):
+    with _conv_cache_lock:
+        _conv_cache[conversation_id] = conversation
+
+
+def cached_active(user_id: str):
+    """Copy of the user's cached active conversation {id, label}, None on a miss"""
+    with _conv_cache_lock:
+        cached = _active_cache.get(user_id)
+    return dict(cached) if cached is not None else None
+
+
+def remember_active(user_id: str, conversation: dict):
+    with _conv_cache_lock:
+        _active_cache[user_id] = conversation
+
+
+def forget_conversation(conversation_id: int):
+    """Invalidate one cached conversation row (and the active entry pointing at it)"""
+    with _conv_cache_lock:
+        _conv_cache.pop(conversation_id, None)
+        for user_id in [u for u, c in list(_active_cache.items()) if c['id'] == conversation_id]:
+            _active_cache.pop(user_id, None)
+
+
+def forget_user_conversations(user_id: str):
+    """Invalidate every cached row of a user (is_active flips on create/switch)"""
+    with _conv_cache_lock:
+        _active_cache.pop(user_id, None)
+        for conversation_id in list(_conv_cache):
+            cached = _conv_cache.get(conversation_id)
+            if cached and cached['user_id'] == user_id:
+                _conv_cache.pop(conversation_id, None)
+
+
+# ============================================
+# SIDEBAR CACHE
+# ============================================
+
+# get_all_conversations is the heaviest read and the sidebar polls it
+# (user_id, limit, before) → page, dropped on every write that can change it
+# (off with several workers → a stale page from this process would be served under
+# the fresh ETag another worker's write produced, and the client would keep it)
+_sidebar_cache = TTLCache(maxsize=10_000, ttl=0 if MULTI_WORKER else 5)
+_sidebar_cache_lock = threading.Lock()
+
+
+def cached_sidebar(key: tuple):
+    with _sidebar_cache_lock:
+        return _sidebar_cache.get(key)
+
+
+def remember_sidebar(key: tuple, conversations: list):
+    with _sidebar_cache_lock:
+        _sidebar_cache[key] = conversations
+
+
+def invalidate_sidebar(user_id: str = None, conversation_id: int = None):
+    """
+    Drop the cached sidebar pages of a user
+    Only conversation_id known → owner taken from the conversation cache
+    (call before forget_conversation), unknown owner → clear everything
+    """
+    if user_id is None and conversation_id is not None:
+        with _conv_cache_lock:
+            cached = _conv_cache.get(conversation_id)
+        user_id = cached['user_id'] if cached else None
+
+    with _sidebar_cache_lock:
+        if user_id is None:
+            _sidebar_cache.clear()
+            return
+        for key in [k for k in list(_sidebar_cache) if k[0] == user_id]:
+            _sidebar_cache.pop(key, None)
+
+
+# ============================================
+# HISTORY CACHE
+# ============================================
+
+# (user_id, conversation_id) → last HISTORY_CACHE_SIZE messages as (id, message)
+# Always a suffix of chat_history → /chat skips the pre-LLM SELECT on turns 2..N
+# In-process only: with several workers another process can append to the same
+# chat → off by default there (HISTORY_CACHE=0/1 overrides)
+HISTORY_CACHE_ENABLED = os.getenv("HISTORY_CACHE", "0" if MULTI_WORKER else "1") == "1"
+HISTORY_CACHE_SIZE = 16
+_history_cache = TTLCache(maxsize=5_000, ttl=600)
+_history_lock = threading.Lock()
+
+
+def _history_message(role, content, attachments):
+    """Row → the dict shape get_chat_history returns (attachments as a list)"""
+    if isinstance(attachments, (str, bytes, bytearray)):
+        attachments = json.loads(attachments)
+    return {"role": role, "content": content, "attachments": attachments or None}
+
+
+def fill_history(user_id: str, conversation_id: int, rows: list):
+    """(Re)fill the cached suffix from the newest rows, (id, role, content, attachments) newest first"""
+    entry = {
+        "rows": deque(
+            ((message_id, _history_message(role, content, attachments))
+             for message_id, role, content, attachments in reversed(rows)),
+            maxlen=HISTORY_CACHE_SIZE
+        ),
+        "complete": len(rows) < HISTORY_CACHE_SIZE
+    }
+    with _history_lock:
+        _history_cache[(user_id, conversation_id)] = entry
+
+
+def record_history(user_id: str, conversation_id: int, message_id: int, role: str, content: str, attachments: list = None):
+    """Append a just-stored message to the cached suffix (no-op if not cached)"""
+    if not HISTORY_CACHE_ENABLED or not conversation_id or not message_id:
+        return
+    key = (user_id, conversation_id)
+    with _history_lock:
+        entry = _history_cache.get(key)
+        if entry is None:
+            return
+        if entry["rows"] and entry["rows"][-1][0] >= message_id:
+            # Out of order → can't trust the suffix anymore
+            _history_cache.pop(key, None)
+            return
+        entry["rows"].append((message_id, _history_message(role, content, attachments)))
+        if len(entry["rows"]) == entry["rows"].maxlen:
+            entry["complete"] = False  # oldest message just fell off
+
+
+def forget_history(conversation_id: int = None):
+    """Drop cached history of a conversation (deletes, bulk inserts), None → everything"""
+    with _history_lock:
+        if conversation_id is None:
+            _history_cache.clear()
+            return
+        for key in [k for k in list(_history_cache) if k[1] == conversation_id]:
+            _history_cache.pop(key, None)
+
+
+def cached_history(user_id: str, conversation_id: int, limit: int, before_id: int = None):
+    """Last `limit` cached messages older than before_id, None when the cache can't answer"""
+    with _history_lock:
+        entry = _history_cache.get((user_id, conversation_id))
+        if entry is None:
+            return None
+        rows = list(entry["rows"])
+        complete = entry["complete"]
+
+    # The message just stored must already be in → otherwise the suffix is stale
+    if before_id is not None and (not rows or rows[-1][0] < before_id):
+        return None
+
+    history = [message for message_id, message in rows if before_id is None or message_id < before_id]
+    if len(history) >= limit:
+        return history[-limit:]
+    return history if complete else None
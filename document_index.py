@@ -0,0 +1,180 @@
+"""
+document_index.py
+Uploaded file text → chunks in a per-conversation vector index
+/chat pulls the few chunks closest to the question instead of replaying the whole file
+Off unless DOC_INDEX=1 and the embedding deps are installed
+
+The text itself lives in conversation_documents (migrations/007) → the index is
+only a per-process cache of it, rebuilt lazily after a restart, an LRU eviction,
+or when the upload landed on another worker
+"""
+
+import os
+import threading
+import time
+from cachetools import LRUCache
+from embeddings import HAVE_EMBEDDINGS, embed, new_index, as_ids
+from db_common import MULTI_WORKER
+from database import get_document_ids, get_documents
+
+DOC_INDEX_ENABLED = os.getenv("DOC_INDEX", "0") == "1" and HAVE_EMBEDDINGS
+
+# Overlapping windows → a sentence cut at one boundary is whole in the next chunk
+CHUNK_CHARS = 800
+CHUNK_STEP = 600
+TOP_K = 4
+
+# How much of an upload gets indexed (the chat-message path keeps only 2000 chars)
+DOC_INDEX_MAX_CHARS = 200_000
+
+# Queued chunks are embedded together once this many wait, else after FLUSH_DELAY seconds
+FLUSH_CHUNKS = 8
+FLUSH_DELAY = 0.5
+FLUSH_BATCH_SIZE = 64
+
+# conversation_id → {"index": faiss index, "chunks": {id: (filename, text)}, "next_id": int, "documents": {document ids}}
+_indexes = LRUCache(maxsize=256)
+_lock = threading.Lock()
+
+# (conversation_id, document_id, filename, chunk) waiting for the next flush
+_pending = []
+# Batches taken off _pending but not yet indexed → [(conversation ids, done event)]
+# A search waits only for the ones holding its own conversation
+_in_flight = []
+
+# conversation_id → (monotonic time of the last DB check, had documents)
+# The only worker sees every upload → one check per conversation is enough;
+# with several, another worker may have taken an upload → re-check now and then
+DOC_SYNC_INTERVAL = 30 if MULTI_WORKER else float("inf")
+_synced = LRUCache(maxsize=4_096)
+
+
+def chunk_text(text):
+    return [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_STEP)]
+
+
+def _document_rows(conversation_id, document_id, filename, text):
+    return [(conversation_id, document_id, filename, chunk) for chunk in chunk_text(text) if chunk.strip()]
+
+
+def _add_rows(rows):
+    """
+    Embed rows in ONE encode call and file them under their conversations
+    Documents already in a conversation's index are skipped (queued + rebuilt at once,
+    or two flushes racing)
+    """
+    if not rows:
+        return 0
+    vectors = embed([chunk for _, _, _, chunk in rows], batch_size=FLUSH_BATCH_SIZE)
+
+    added = 0
+    with _lock:
+        indexed = {
+            cid: set(_indexes[cid]["documents"])
+            for cid in {row[0] for row in rows} if cid in _indexes
+        }
+        for row, (conversation_id, document_id, filename, chunk) in enumerate(rows):
+            if document_id in indexed.get(conversation_id, ()):
+                continue
+            entry = _indexes.get(conversation_id)
+            if entry is None:
+                entry = _indexes[conversation_id] = {"index": new_index(), "chunks": {}, "next_id": 0, "documents": set()}
+            chunk_id = entry["next_id"]
+            entry["next_id"] += 1
+            entry["index"].add_with_ids(vectors[row:row + 1], as_ids([chunk_id]))
+            entry["chunks"][chunk_id] = (filename, chunk)
+            entry["documents"].add(document_id)
+            added += 1
+    return added
+
+
+def queue_document(conversation_id: int, document_id: int, filename: str, text: str):
+    """Chunk a stored upload and park it for the next batched encode, returns how many chunks are waiting"""
+    rows = _document_rows(conversation_id, document_id, filename, text)
+    with _lock:
+        _pending.extend(rows)
+        return len(_pending)
+
+
+def flush_pending_documents(conversation_id: int = None):
+    """Index queued chunks (only this conversation's when given), returns the number of chunks added"""
+    with _lock:
+        if conversation_id is None:
+            batch = _pending[:]
+            _pending.clear()
+        else:
+            batch = [row for row in _pending if row[0] == conversation_id]
+            _pending[:] = [row for row in _pending if row[0] != conversation_id]
+        waits = [done for ids, done in _in_flight if conversation_id in ids]
+        flight = ({row[0] for row in batch}, threading.Event())
+        _in_flight.append(flight)
+
+    try:
+        added = _add_rows(batch)
+    except Exception:
+        # Those chunks are gone from the queue → let the next search reload them from the DB
+        with _lock:
+            for cid in flight[0]:
+                _synced.pop(cid, None)
+        raise
+    finally:
+        with _lock:
+            _in_flight.remove(flight)
+        flight[1].set()
+
+    # An earlier flush was already embedding this conversation's chunks
+    for done in waits:
+        done.wait()
+    return added
+
+
+def _sync_conversation(conversation_id: int):
+    """Load + index documents of this conversation the local index doesn't have yet"""
+    now = time.monotonic()
+    with _lock:
+        synced = _synced.get(conversation_id)
+        entry = _indexes.get(conversation_id)
+        # Recently checked, and the index wasn't evicted since
+        if synced and now - synced[0] < DOC_SYNC_INTERVAL and (entry or not synced[1]):
+            return
+        indexed = set(entry["documents"]) if entry else set()
+
+    stored = get_document_ids(conversation_id)
+    if stored is None:
+        return
+    missing = stored - indexed
+    rows = []
+    loaded = set()
+    for document_id, doc_conversation_id, filename, content in get_documents(sorted(missing)):
+        rows.extend(_document_rows(doc_conversation_id, document_id, filename, content))
+        loaded.add(document_id)
+    _add_rows(rows)
+
+    if loaded == missing:
+        with _lock:
+            _synced[conversation_id] = (now, bool(stored))
+
+
+def search_documents(conversation_id: int, query: str, k: int = TOP_K):
+    """[(filename, chunk)] most relevant to query, [] when nothing was uploaded here"""
+    # A file uploaded here a moment ago may still be queued (or mid-flush) → index it first
+    flush_pending_documents(conversation_id)
+    _sync_conversation(conversation_id)
+
+    with _lock:
+        entry = _indexes.get(conversation_id)
+        if not entry:
+            return []
+
+    vector = embed([query])
+    with _lock:
+        scores, ids = entry["index"].search(vector, k)
+        return [entry["chunks"][int(i)] for i in ids[0] if i != -1]
+
+
+def forget_documents(conversation_id: int):
+    """Drop a conversation's index + queued chunks (rows go with the conversation via ON DELETE CASCADE)"""
+    with _lock:
+        _indexes.pop(conversation_id, None)
+        _synced.pop(conversation_id, None)
+        _pending[:] = [row for row in _pending if row[0] != conversation_id]
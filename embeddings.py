@@ -0,0 +1,74 @@
+"""
+embeddings.py
+Sentence embeddings + FAISS index helpers
+Optional — only used when sentence-transformers and faiss-cpu are installed
+"""
+
+import os
+import threading
+from importlib.util import find_spec
+
+try:
+    import numpy as np
+    import faiss
+    # sentence-transformers pulls in torch → only imported when the model is first needed
+    HAVE_EMBEDDINGS = find_spec("sentence_transformers") is not None
+except ImportError:
+    HAVE_EMBEDDINGS = False
+
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL", "BAAI/bge-small-en-v1.5")
+EMBED_DIM = 384
+
+# flat → exact fp32 scan (default; per-user / per-chat indexes stay in the hundreds)
+# fp16 → half the bytes per vector, no training needed, near-exact scores
+# hnsw → graph ANN, ~log N search once an index reaches tens of thousands of vectors
+EMBED_INDEX = os.getenv("EMBED_INDEX", "flat")
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Load the embedding model once per process (first call pays the load)"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(EMBED_MODEL_NAME)
+    return _model
+
+
+def embed(texts, batch_size=32):
+    """float32 (len(texts), EMBED_DIM), L2-normalized → inner product = cosine"""
+    return get_model().encode(
+        list(texts),
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        convert_to_numpy=True
+    ).astype(np.float32, copy=False)
+
+
+def new_index(removable=False):
+    """
+    Inner-product index with caller-chosen int64 ids, type picked by EMBED_INDEX
+    removable → the caller evicts single entries; HNSW can't, so fp16 is used instead
+    """
+    kind = EMBED_INDEX
+    if kind == "hnsw" and removable:
+        kind = "fp16"
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(EMBED_DIM, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif kind == "fp16":
+        index = faiss.IndexScalarQuantizer(EMBED_DIM, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexFlatIP(EMBED_DIM)
+    return faiss.IndexIDMap(index)
+
+
+def as_ids(ids):
+    return np.asarray(ids, dtype=np.int64)
@@ -6,27 +6,47 @@ Integrates with Finanvo authentication system
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from database import store_message, get_chat_history
-from chatbot import get_ai_response
-from database_Conv import ensure_active_conversation, update_label_if_default
+from database import store_message, store_messages_bulk, get_chat_history, store_document
+from chatbot import get_ai_response, stream_ai_response, TEXT_FALLBACK_NOTE
+from semantic_cache import SEMANTIC_CACHE_ENABLED, semantic_lookup, semantic_store
+from document_index import (
+    DOC_INDEX_ENABLED, DOC_INDEX_MAX_CHARS, FLUSH_CHUNKS, FLUSH_DELAY,
+    queue_document, flush_pending_documents, search_documents
+)
+from database_Conv import ensure_active_conversation, ensure_and_store_message, update_label_if_default
 import uvicorn
 import os
-import shutil
+import aiofiles
+import aiofiles.os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from groq import AsyncGroq
+from cachetools import LRUCache
 import fitz  # PyMuPDF
+import pymupdf4llm
 import base64
-from uuid import uuid4
+import secrets
+import shutil
 from docx import Document
 from typing import Optional
 from spire.doc import Document as SpireDocument
 import json
+from anyio import to_thread
+from starlette.background import BackgroundTask
+import orjson
 
 # Import routers
 from api import router as conversations_router
 from admin_api import router as admin_router
 
-app = FastAPI(title="Technowire AI Assistant")
+# orjson encodes the chat/message lists several times faster than stdlib json
+app = FastAPI(title="Technowire AI Assistant", default_response_class=ORJSONResponse)
 
 # ============================================
 # SETUP
@@ -35,6 +55,34 @@ app = FastAPI(title="Technowire AI Assistant")
 UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+# Public origin clients reach uploads on (override behind a proxy / other host)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "https://chatbot-api-dtad.onrender.com").rstrip("/")
+UPLOAD_URL_PREFIX = f"{PUBLIC_BASE_URL}/uploads/"
+
+# Prompt history is cut at this many (estimated) tokens, on top of the 15-message limit
+HISTORY_TOKEN_BUDGET = 3000
+
+# In-flight fire-and-forget tasks → strong refs so they aren't GC'd mid-run
+_BG_TASKS = set()
+
+# uvicorn worker processes → each one has its own caches, DB pools and DOC_POOL
+# (db_common.MULTI_WORKER turns the write-invalidated caches off when there are
+# several — also detected from --workers / -w, but WEB_CONCURRENCY is the reliable way)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Worker processes for document text extraction (created on startup)
+DOC_POOL = None
+
+# Small dedicated pool for plain-file reads → uploads never eat into the
+# AnyIO threadpool that the DB calls share
+FILE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="file-extract")
+
+# One client → its HTTP connection pool is reused by every label call
+_GROQ_KEY = os.getenv("GROQ_API_KEY")
+_GROQ_CLIENT = AsyncGroq(api_key=_GROQ_KEY) if _GROQ_KEY else None
 
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
@@ -44,6 +92,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Conversation-Id"],
 )
 
 # Register routers
@@ -51,10 +100,62 @@ app.include_router(conversations_router)
 app.include_router(admin_router)
 
 
+@app.on_event("startup")
+async def raise_threadpool_limit():
+    """
+    Sync route handlers (sidebar + admin) and the run_in_threadpool DB calls
+    in /chat, /upload run on AnyIO's threadpool
+    Default is 40 threads — raise it so DB-bound requests don't queue
+    Threads beyond the DB pools' capacity wait in db_common.get_db_connection
+    (bounded overflow) instead of opening a connection each
+    """
+    to_thread.current_default_thread_limiter().total_tokens = 200
+
+
+@app.on_event("startup")
+async def warm_up_db_pools():
+    """Connect both DB pools now instead of on the first /chat"""
+    from db_common import warm_up_pool
+    from database import POOL_NAME as HISTORY_POOL
+    from database_Conv import POOL_NAME as CONV_POOL
+
+    await run_in_threadpool(warm_up_pool, HISTORY_POOL)
+    await run_in_threadpool(warm_up_pool, CONV_POOL)
+
+
+@app.on_event("startup")
+async def start_doc_pool():
+    """
+    PDF / Word parsing is pure CPU → separate processes, so it neither blocks
+    the event loop nor fights the GIL with request threads
+    """
+    global DOC_POOL
+    # forkserver (spawn where it doesn't exist) → children start clean instead of
+    # forking this process with its threads, locks, Groq client and DB sockets
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    # Split the cores between uvicorn workers instead of cores × workers processes
+    DOC_POOL = ProcessPoolExecutor(
+        max_workers=max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY),
+        mp_context=multiprocessing.get_context(start_method)
+    )
+
+
+@app.on_event("shutdown")
+async def stop_doc_pool():
+    if DOC_POOL:
+        DOC_POOL.shutdown(wait=False, cancel_futures=True)
+    FILE_POOL.shutdown(wait=False, cancel_futures=True)
+
+
 # ============================================
 # AUTHENTICATION HELPER
 # ============================================
 
+@lru_cache(maxsize=10_000)
+def _normalize_token(authorization: str) -> str:
+    """Strip the "Bearer " prefix — same header every request, so memoized"""
+    return authorization.replace("Bearer ", "").strip()
+
 def extract_user_id_from_token(authorization: str) -> str:
     """
     Extract user_id from the authorization token.
@@ -68,7 +169,7 @@ def extract_user_id_from_token(authorization: str) -> str:
     
     # Use the token itself as user_id (it's already unique per user)
     # Clean it up if needed (remove "Bearer " prefix if present)
-    token = authorization.replace("Bearer ", "").strip()
+    token = _normalize_token(authorization)
     
     if not token:
         raise HTTPException(
@@ -92,76 +193,210 @@ class ChatRequest(BaseModel):
 # HELPER FUNCTIONS
 # ============================================
 
-def extract_text_from_pdf(file_path):
-    """Extracts text content from a PDF file."""
+# Only the first 2000 chars are stored → read a bit more than that, then stop
+EXTRACT_MAX_CHARS = 2048
+
+# antiword → small C .doc-to-text converter, much faster than Spire (used when installed)
+ANTIWORD = shutil.which("antiword")
+ANTIWORD_TIMEOUT = 30
+SPIRE_WATERMARK = "Evaluation Warning: The document was created with Spire.Doc for Python."
+
+# Pages sampled to work out PDF heading sizes
+PDF_HEADER_SAMPLE_PAGES = 5
+
+def extract_text_from_pdf(file_path, max_chars=EXTRACT_MAX_CHARS):
+    """Extracts a PDF as Markdown — headings, lists, tables kept (stops once max_chars are collected)."""
     try:
-        doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
+        parts = []
+        total = 0
+        with fitz.open(file_path) as doc:
+            # Font-size → heading levels, from the first few pages only
+            # (without hdr_info every to_markdown call would rescan the whole file)
+            hdr_info = pymupdf4llm.IdentifyHeaders(doc, pages=list(range(min(doc.page_count, PDF_HEADER_SAMPLE_PAGES))))
+            # One page per call → later pages are never converted once the cap is hit
+            for page_number in range(doc.page_count):
+                text = pymupdf4llm.to_markdown(doc, pages=[page_number], hdr_info=hdr_info)
+                parts.append(text)
+                total += len(text)
+                if total >= max_chars:
+                    break
+        return "".join(parts)[:max_chars]
     except Exception as e:
         print(f"Error extracting PDF text: {e}")
         return None
 
-def extract_text_from_word(file_path):
-    """Extracts text from .doc and .docx files."""
+def extract_text_from_word(file_path, max_chars=EXTRACT_MAX_CHARS):
+    """Extracts text from .doc and .docx files (stops once max_chars are collected)."""
     try:
         if file_path.endswith(".docx"):
             doc = Document(file_path)
-            return "\n".join([para.text for para in doc.paragraphs])
+            parts = []
+            total = 0
+            for para in doc.paragraphs:
+                parts.append(para.text)
+                total += len(para.text) + 1
+                if total >= max_chars:
+                    break
+            return "\n".join(parts)[:max_chars]
         doc = SpireDocument()
         doc.LoadFromFile(file_path)
         text = doc.GetText()
         doc.Close()
-        return text
+        # Free Spire stamps every document → keep it out of the chat context
+        return text.replace(SPIRE_WATERMARK, "").lstrip()[:max_chars]
     except Exception as e:
         print(f"Error extracting Word text: {e}")
         return ""
 
-def extract_text_from_plain_file(file_path):
-    """Extracts text from .txt, .json, .csv, .py files."""
+async def extract_text_from_doc_antiword(file_path, max_chars=EXTRACT_MAX_CHARS):
+    """Extracts text from a legacy .doc via antiword, None if it isn't installed or fails."""
+    if not ANTIWORD:
+        return None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            ANTIWORD, "-m", "UTF-8.txt", file_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except OSError as e:
+        # Binary removed / not executable since startup → caller falls back to Spire
+        print(f"antiword failed to start: {e}")
+        return None
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout=ANTIWORD_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        print(f"antiword timed out on {file_path}")
+        return None
+    if proc.returncode != 0:
+        return None
+    return out.decode("utf-8", "ignore")[:max_chars]
+
+def extract_text_from_plain_file(file_path, max_chars=EXTRACT_MAX_CHARS):
+    """Extracts text from .txt, .json, .csv, .py files (reads at most max_chars)."""
     try:
         with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
+            return f.read(max_chars)
     except Exception as e:
         print(f"Text Extraction Error: {e}")
         return None
 
-def generate_chat_label(user_message: str, ai_reply: str) -> str:
+# (message, reply) prefix → title
+_label_cache = LRUCache(maxsize=512)
+
+async def _label_prompt(user_message: str, ai_reply: str) -> str:
+    """Groq title call, memoized per (message, reply) prefix — failures are not cached"""
+    key = (user_message, ai_reply)
+    if key in _label_cache:
+        return _label_cache[key]
+    if _GROQ_CLIENT is None:
+        raise RuntimeError("GROQ_API_KEY is not set")
+
+    response = await _GROQ_CLIENT.chat.completions.create(
+        model="llama-3.3-70b-versatile",
+        messages=[
+            {
+                "role": "system",
+                "content": "Generate a very short title (3-5 words max) for this conversation. Return ONLY the title, nothing else. No quotes, no punctuation."
+            },
+            {
+                "role": "user",
+                "content": f"User said: {user_message}\nAssistant replied: {ai_reply}"
+            }
+        ],
+        temperature=0.3,
+        max_tokens=20
+    )
+    label = response.choices[0].message.content.strip()
+    _label_cache[key] = label
+    return label
+
+# Short openers that get a fixed title instead of a Groq call
+GREETING_WORDS = frozenset({"hi", "hello", "hey", "thanks", "thank"})
+LOCAL_LABEL_MAX_WORDS = 5
+
+def local_chat_label(user_message: str) -> Optional[str]:
+    """Title for short messages without an LLM call, None when Groq should decide"""
+    words = user_message.split()
+    if not words or len(words) > LOCAL_LABEL_MAX_WORDS:
+        return None
+    if words[0].strip(",.!?").lower() in GREETING_WORDS:
+        return "Greeting"
+    return " ".join(words).strip(".?!").title()[:50] or None
+
+async def generate_chat_label(user_message: str, ai_reply: str) -> str:
     """
     Auto-generate a short chat title from the first message
-    Uses Groq to create a 4-5 word title
+    Short messages (≤ 5 words) are title-cased locally
+    Otherwise uses Groq to create a 4-5 word title
     Falls back to first 40 chars of user message if Groq fails
     """
-    try:
-        from groq import Groq
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Generate a very short title (3-5 words max) for this conversation. Return ONLY the title, nothing else. No quotes, no punctuation."
-                },
-                {
-                    "role": "user",
-                    "content": f"User said: {user_message[:200]}\nAssistant replied: {ai_reply[:200]}"
-                }
-            ],
-            temperature=0.3,
-            max_tokens=20
-        )
+    label = local_chat_label(user_message)
+    if label:
+        return label
 
-        label = response.choices[0].message.content.strip()
+    try:
+        label = await _label_prompt(user_message[:200], ai_reply[:200])
         return label[:50] if label else user_message[:40]
 
     except Exception as e:
         print(f"Auto-label generation failed: {e}")
         return user_message[:40]
 
+async def cached_reply(user_id: str, conversation_id: int, user_message: str, history: list):
+    """(earlier reply to a near-identical question or None, query vector for storing a miss)"""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None, None
+    try:
+        return await run_in_threadpool(semantic_lookup, user_id, conversation_id, user_message, history)
+    except Exception as e:
+        print(f"Semantic cache lookup failed: {e}")
+        return None, None
+
+async def relevant_documents(conversation_id: int, user_message: str):
+    """Uploaded-file chunks closest to the question ([] when the index is off/empty)"""
+    if not DOC_INDEX_ENABLED:
+        return []
+    try:
+        return await run_in_threadpool(search_documents, conversation_id, user_message)
+    except Exception as e:
+        print(f"Document search failed: {e}")
+        return []
+
+def remember_reply(user_id: str, conversation_id: int, query_vector, ai_reply: str):
+    """Cache a fresh reply — errors and vision fallbacks are never reused"""
+    if query_vector is None or ai_reply.startswith("AI Error:") or ai_reply.endswith(TEXT_FALLBACK_NOTE):
+        return
+    try:
+        semantic_store(user_id, conversation_id, query_vector, ai_reply)
+    except Exception as e:
+        print(f"Semantic cache store failed: {e}")
+
+async def auto_label_conversation(conversation_id: int, user_message: str, ai_reply: str):
+    """Background task → runs after /chat has already replied"""
+    try:
+        new_label = await generate_chat_label(user_message, ai_reply)
+        if await run_in_threadpool(update_label_if_default, conversation_id, new_label):
+            print(f"[CHAT] Auto-labeled: {new_label}")
+    except Exception as e:
+        print(f"Auto-label failed: {e}")
+
+async def flush_document_index(delay: float = 0):
+    """Embed queued upload chunks after delay (uploads landing together share one encode)"""
+    await asyncio.sleep(delay)
+    try:
+        await run_in_threadpool(flush_pending_documents)
+    except Exception as e:
+        print(f"Document indexing failed: {e}")
+
+def spawn_background(coro):
+    """Run a coroutine on the loop without awaiting it (kept alive in _BG_TASKS)"""
+    task = asyncio.create_task(coro)
+    _BG_TASKS.add(task)
+    task.add_done_callback(_BG_TASKS.discard)
+    return task
+
 
 # ============================================
 # ROOT
@@ -193,8 +428,9 @@ async def chat(
         
         print(f"[CHAT] User Token: {user_id[:20]}..., Message: {request.message[:50]}...")
         
-        # Get or create active conversation FOR THIS USER ONLY
-        active_conv = ensure_active_conversation(user_id)
+        # Get or create active conversation FOR THIS USER ONLY + store the message
+        # (one stored-procedure call instead of 2-4 round-trips)
+        active_conv, message_id = await run_in_threadpool(ensure_and_store_message, user_id, "user", request.message)
         
         if not active_conv:
             raise HTTPException(
@@ -205,24 +441,24 @@ async def chat(
         conversation_id = active_conv['id']
         print(f"[CHAT] Conversation ID: {conversation_id}")
 
-        # Store user message
-        store_message(user_id, "user", request.message, conversation_id)
-
         # Get history from THIS USER's conversation only
-        history = get_chat_history(user_id, conversation_id=conversation_id, limit=15)
+        # (older than the message just stored — get_ai_response appends it)
+        history = await run_in_threadpool(get_chat_history, user_id, conversation_id=conversation_id, limit=15, before_id=message_id, max_tokens=HISTORY_TOKEN_BUDGET)
         print(f"[CHAT] History length: {len(history)}")
 
-        # Get AI response
-        ai_reply = get_ai_response(request.message, history)
+        # Get AI response (a cached one if this was asked before)
+        ai_reply, query_vector = await cached_reply(user_id, conversation_id, request.message, history)
+        if ai_reply is None:
+            documents = await relevant_documents(conversation_id, request.message)
+            ai_reply = await get_ai_response(request.message, history, documents)
+            remember_reply(user_id, conversation_id, query_vector, ai_reply)
 
-        # Store AI reply
-        store_message(user_id, "assistant", ai_reply, conversation_id)
+        # Store AI reply (user message is already in)
+        await run_in_threadpool(store_message, user_id, "assistant", ai_reply, conversation_id)
 
-        # Auto-label
+        # Auto-label (first reply of a chat only) → off the response path entirely
         if active_conv.get('label') == 'New Chat':
-            new_label = generate_chat_label(request.message, ai_reply)
-            update_label_if_default(conversation_id, new_label)
-            print(f"[CHAT] Auto-labeled: {new_label}")
+            spawn_background(auto_label_conversation(conversation_id, request.message, ai_reply))
 
         return {
             "status": "success",
@@ -240,6 +476,140 @@ async def chat(
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
+# ============================================
+# CHAT ENDPOINT (streaming)
+# ============================================
+
+async def finish_streamed_turn(user_id: str, conversation_id: int, user_message: str, reply_parts: list, turn: dict, needs_label: bool, query_vector=None):
+    """
+    Runs after the last streamed byte → store the full reply, then auto-label
+    Skipped when the client disconnected mid-stream or the model failed
+    (reply_parts would be a truncated / error reply, not an answer worth keeping)
+    """
+    if not turn["completed"] or turn["error"]:
+        print(f"[CHAT STREAM] Reply not stored (completed={turn['completed']}, error={turn['error']})")
+        return
+    ai_reply = "".join(reply_parts)
+    remember_reply(user_id, conversation_id, query_vector, ai_reply)
+    await run_in_threadpool(store_message, user_id, "assistant", ai_reply, conversation_id)
+    if needs_label:
+        await auto_label_conversation(conversation_id, user_message, ai_reply)
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Same as /chat, but the reply arrives as Server-Sent Events
+    data: {"token": "..."} per piece, then data: [DONE]
+    Reply storage + auto-label happen after the stream ends
+    """
+    try:
+        user_id = extract_user_id_from_token(authorization)
+
+        print(f"[CHAT STREAM] User Token: {user_id[:20]}..., Message: {request.message[:50]}...")
+
+        active_conv, message_id = await run_in_threadpool(ensure_and_store_message, user_id, "user", request.message)
+        if not active_conv:
+            raise HTTPException(
+                status_code=503, 
+                detail="Database connection failed. Please try again later."
+            )
+
+        conversation_id = active_conv['id']
+        history = await run_in_threadpool(get_chat_history, user_id, conversation_id=conversation_id, limit=15, before_id=message_id, max_tokens=HISTORY_TOKEN_BUDGET)
+
+        cached, query_vector = await cached_reply(user_id, conversation_id, request.message, history)
+        documents = await relevant_documents(conversation_id, request.message) if cached is None else []
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[CHAT STREAM ERROR] {type(e).__name__}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+    reply_parts = []
+    # completed → the last token went out; error → the model call failed partway
+    turn = {"completed": False, "error": False}
+
+    async def event_stream():
+        if cached is not None:
+            reply_parts.append(cached)
+            yield b"data: " + orjson.dumps({"token": cached}) + b"\n\n"
+        else:
+            async for token in stream_ai_response(request.message, history, documents, state=turn):
+                reply_parts.append(token)
+                yield b"data: " + orjson.dumps({"token": token}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+        turn["completed"] = True
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Conversation-Id": str(conversation_id)},
+        background=BackgroundTask(
+            finish_streamed_turn, user_id, conversation_id, request.message, reply_parts, turn,
+            active_conv.get('label') == 'New Chat',
+            None if cached is not None else query_vector
+        )
+    )
+
+
+# ============================================
+# UPLOAD HANDLERS (one per file type)
+# → (extracted text or None, context message or None, attachments or None)
+# ============================================
+
+async def _handle_pdf(file_path: str, filename: str, file_url: str, text_cap: int):
+    text = await asyncio.get_running_loop().run_in_executor(DOC_POOL, extract_text_from_pdf, file_path, text_cap)
+    if not text:
+        return None, None, None
+    context_msg = (
+        f"BACKGROUND_DATA: The user has uploaded a file named {filename}. "
+        f"Content summary: {text[:2000]}. Use this info ONLY if asked."
+    )
+    return text, context_msg, None
+
+async def _handle_word(file_path: str, filename: str, file_url: str, text_cap: int):
+    text = None
+    if file_path.endswith(".doc"):
+        text = await extract_text_from_doc_antiword(file_path, text_cap)
+    if not text:
+        text = await asyncio.get_running_loop().run_in_executor(DOC_POOL, extract_text_from_word, file_path, text_cap)
+    if not text:
+        return None, None, None
+    return text, f"SYSTEM: User uploaded a Word doc: {filename}. Content: {text[:2000]}", None
+
+async def _handle_image(file_path: str, filename: str, file_url: str, text_cap: int):
+    context_msg = f"SYSTEM: User uploaded an image: {filename}. (The image is accessible at {file_url})"
+    return None, context_msg, [file_path]
+
+async def _handle_plain(file_path: str, filename: str, file_url: str, text_cap: int):
+    text = await asyncio.get_running_loop().run_in_executor(FILE_POOL, extract_text_from_plain_file, file_path, text_cap)
+    if not text:
+        return None, None, None
+    return text, f"BACKGROUND_DATA: Content of {filename}:\n{text[:2000]}", None
+
+_EXT_HANDLERS = {
+    ".pdf": _handle_pdf,
+    ".doc": _handle_word,
+    ".docx": _handle_word,
+    ".jpg": _handle_image,
+    ".jpeg": _handle_image,
+    ".png": _handle_image,
+    ".json": _handle_plain,
+    ".txt": _handle_plain,
+    ".csv": _handle_plain,
+    ".py": _handle_plain,
+}
+
+ALLOWED_EXTS = frozenset(_EXT_HANDLERS)
+
+
 # ============================================
 # UPLOAD ENDPOINT
 # ============================================
@@ -260,9 +630,16 @@ async def upload_file(
         user_id = extract_user_id_from_token(authorization)
         
         print(f"[UPLOAD] User Token: {user_id[:20]}..., File: {file.filename}")
+
+        # Reject before touching the DB or the disk
+        file_extension = os.path.splitext(file.filename)[1].lower()
+        if file_extension not in ALLOWED_EXTS:
+            raise HTTPException(status_code=415, detail=f"Unsupported file type: {file_extension or 'none'}")
+        if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
         
         # Ensure active conversation FOR THIS USER
-        active_conv = ensure_active_conversation(user_id)
+        active_conv = await run_in_threadpool(ensure_active_conversation, user_id)
         
         if not active_conv:
             raise HTTPException(
@@ -272,46 +649,54 @@ async def upload_file(
         
         conversation_id = active_conv['id']
 
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        unique_filename = f"{uuid4()}{file_extension}"
+        unique_filename = secrets.token_hex(16) + file_extension
         file_path = os.path.join(UPLOAD_DIR, unique_filename)
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        file_url = f"https://chatbot-api-dtad.onrender.com/uploads/{unique_filename}"
-
-        # --- PDF ---
-        if file_extension == ".pdf":
-            pdf_text = extract_text_from_pdf(file_path)
-            if pdf_text:
-                context_msg = (
-                    f"BACKGROUND_DATA: The user has uploaded a file named {file.filename}. "
-                    f"Content summary: {pdf_text[:2000]}. Use this info ONLY if asked."
+        # 1 MiB chunks, non-blocking → the loop keeps serving while big files land
+        written = 0
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    break
+                await buffer.write(chunk)
+        # Drop the spooled temp copy now instead of when the request is torn down
+        await file.close()
+
+        # No size up front (e.g. chunked body) → enforced while writing
+        if written > MAX_UPLOAD_BYTES:
+            await aiofiles.os.remove(file_path)
+            raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+
+        file_url = UPLOAD_URL_PREFIX + unique_filename
+
+        # Messages for this upload → stored together with one INSERT
+        pending = []
+        text_cap = DOC_INDEX_MAX_CHARS if DOC_INDEX_ENABLED else EXTRACT_MAX_CHARS
+
+        # Text pulled from the file + the chat message that carries its first 2000 chars
+        # (file_extension is in ALLOWED_EXTS → always has a handler)
+        handler = _EXT_HANDLERS[file_extension]
+        extracted_text, context_msg, attachments = await handler(file_path, file.filename, file_url, text_cap)
+
+        if extracted_text and DOC_INDEX_ENABLED:
+            # Whole file → vector index; /chat retrieves only the chunks a question needs
+            # Embedding happens off this request, batched with other uploads
+            # The text is stored first → the index can always be rebuilt from the DB
+            document_id = await run_in_threadpool(store_document, conversation_id, file.filename, extracted_text)
+            if document_id is None:
+                raise HTTPException(
+                    status_code=503, 
+                    detail="Database connection failed. Please try again later."
                 )
-                store_message(user_id, "user", context_msg, conversation_id)
-
-        # --- Word Document ---
-        elif file_extension in [".doc", ".docx"]:
-            word_text = extract_text_from_word(file_path)
-            if word_text:
-                context_msg = f"SYSTEM: User uploaded a Word doc: {file.filename}. Content: {word_text[:2000]}"
-                store_message(user_id, "user", context_msg, conversation_id)
-
-        # --- Images ---
-        elif file_extension in [".jpg", ".jpeg", ".png"]:
-            context_msg = f"SYSTEM: User uploaded an image: {file.filename}. (The image is accessible at {file_url})"
-            store_message(user_id, "user", context_msg, conversation_id)
-
-        # --- Text / JSON / CSV / Python ---
-        elif file_extension in [".json", ".txt", ".csv", ".py"]:
-            extracted_content = extract_text_from_plain_file(file_path)
-            if extracted_content:
-                context_msg = f"BACKGROUND_DATA: Content of {file.filename}:\n{extracted_content[:2000]}"
-                store_message(user_id, "user", context_msg, conversation_id)
+            waiting = queue_document(conversation_id, document_id, file.filename, extracted_text)
+            spawn_background(flush_document_index(0 if waiting >= FLUSH_CHUNKS else FLUSH_DELAY))
+        elif context_msg:
+            pending.append((user_id, "user", context_msg, conversation_id, attachments))
 
         # Visible log message in chat
-        store_message(user_id, "user", f"[File Uploaded: {file.filename}]", conversation_id)
+        pending.append((user_id, "user", f"[File Uploaded: {file.filename}]", conversation_id))
+        await run_in_threadpool(store_messages_bulk, pending)
 
         return {
             "status": "success",
@@ -334,9 +719,10 @@ async def upload_file(
 # ============================================
 
 @app.get("/test-db")
-async def test_db():
+def test_db():
     """Test database connection"""
     from database import get_db_connection
+    from db_common import release_connection
     
     conn = get_db_connection()
     if conn:
@@ -345,7 +731,7 @@ async def test_db():
             cursor.execute("SELECT 1 as test")
             result = cursor.fetchone()
             cursor.close()
-            conn.close()
+            release_connection(conn)
             return {
                 "status": "success", 
                 "message": "Database connected successfully!", 
@@ -368,4 +754,15 @@ async def test_db():
 # ============================================
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # auto → uvloop (libuv event loop) + httptools (C HTTP parser) when installed,
+    # asyncio + h11 otherwise (uvloop isn't available on Windows)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=WEB_CONCURRENCY,
+        limit_concurrency=256,
+        backlog=2048
+    )
\ No newline at end of file
@@ -0,0 +1,4 @@
+-- Attachments stored alongside a message (JSON list of local file paths)
+-- Lets the AI layer pick up uploaded images without re-parsing message text
+ALTER TABLE chat_history
+    ADD COLUMN attachments JSON NULL;
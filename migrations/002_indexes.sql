@@ -0,0 +1,11 @@
+-- Composite indexes for the hot chat_history / conversations lookups
+-- Check with EXPLAIN that ORDER BY is served by the index (no "Using filesort")
+
+-- get_chat_history, get_messages_by_conversation
+CREATE INDEX ix_ch_uid_cid_id ON chat_history (user_id, conversation_id, id DESC);
+
+-- get_active_conversation, sidebar list
+CREATE INDEX ix_conv_uid_active_updated ON conversations (user_id, is_active, updated_at DESC);
+
+-- Admin label search (search_conversations_by_label)
+ALTER TABLE conversations ADD FULLTEXT KEY ft_label (label);
@@ -0,0 +1,11 @@
+-- Deleting a conversation removes its messages in the same statement
+-- Replaces the "delete messages, then delete conversation" double call
+
+-- Messages pointing at an already-deleted conversation would block the FK
+DELETE ch FROM chat_history ch
+LEFT JOIN conversations c ON c.id = ch.conversation_id
+WHERE ch.conversation_id IS NOT NULL AND c.id IS NULL;
+
+ALTER TABLE chat_history
+    ADD CONSTRAINT fk_ch_conv FOREIGN KEY (conversation_id)
+    REFERENCES conversations (id) ON DELETE CASCADE;
@@ -0,0 +1,4 @@
+-- Sidebar / admin list: message_count + last_message per conversation
+-- COUNT(*) OVER / ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY id DESC)
+-- read only this index (MySQL 8+)
+CREATE INDEX ix_ch_conv_id ON chat_history (conversation_id, id DESC);
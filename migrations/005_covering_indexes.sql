@@ -0,0 +1,15 @@
+-- Indexes for the remaining hot filter/order paths
+-- (ix_ch_uid_cid_id, ix_conv_uid_active_updated, ix_ch_conv_id already exist)
+
+-- get_active_conversation: WHERE user_id AND is_active ORDER BY created_at DESC LIMIT 1
+CREATE INDEX ix_conv_uid_active_created ON conversations (user_id, is_active, created_at DESC);
+
+-- Sidebar + fingerprint: WHERE user_id ORDER BY updated_at DESC, id DESC (keyset)
+CREATE INDEX ix_conv_uid_updated_id ON conversations (user_id, updated_at DESC, id DESC);
+
+-- Admin messages list: WHERE user_id [AND role] ORDER BY id DESC
+CREATE INDEX ix_ch_uid_role_id ON chat_history (user_id, role, id DESC);
+
+-- The index MySQL created for fk_ch_conv (003) is a prefix of ix_ch_conv_id (004),
+-- which now backs the foreign key
+ALTER TABLE chat_history DROP INDEX fk_ch_conv;
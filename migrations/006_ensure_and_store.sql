@@ -0,0 +1,35 @@
+-- /chat: make sure the user has an active conversation AND store the user message
+-- in one server round-trip (replaces SELECT → [UPDATE + INSERT] → INSERT)
+-- Apply with the mysql client (DELIMITER is a client command)
+
+DROP PROCEDURE IF EXISTS ensure_and_store;
+
+DELIMITER $$
+
+CREATE PROCEDURE ensure_and_store(
+    IN p_user_id VARCHAR(512),
+    IN p_role VARCHAR(16),
+    IN p_content LONGTEXT,
+    OUT p_conversation_id INT,
+    OUT p_label VARCHAR(255),
+    OUT p_message_id BIGINT
+)
+BEGIN
+    SELECT id, label INTO p_conversation_id, p_label
+    FROM conversations
+    WHERE user_id = p_user_id AND is_active = TRUE
+    ORDER BY created_at DESC
+    LIMIT 1;
+
+    IF p_conversation_id IS NULL THEN
+        INSERT INTO conversations (user_id, label, is_active) VALUES (p_user_id, 'New Chat', TRUE);
+        SET p_conversation_id = LAST_INSERT_ID();
+        SET p_label = 'New Chat';
+    END IF;
+
+    INSERT INTO chat_history (user_id, role, content, conversation_id)
+    VALUES (p_user_id, p_role, p_content, p_conversation_id);
+    SET p_message_id = LAST_INSERT_ID();
+END$$
+
+DELIMITER ;
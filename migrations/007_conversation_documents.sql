@@ -0,0 +1,13 @@
+-- Full extracted text of uploaded files (DOC_INDEX=1)
+-- Source of truth for the in-process vector index → rebuilt from here after a
+-- restart, an LRU eviction, or on another worker
+CREATE TABLE conversation_documents (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    conversation_id INT NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    content MEDIUMTEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX ix_cd_conv_id (conversation_id, id),
+    CONSTRAINT fk_cd_conv FOREIGN KEY (conversation_id)
+        REFERENCES conversations (id) ON DELETE CASCADE
+);
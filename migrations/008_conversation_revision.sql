@@ -0,0 +1,16 @@
+-- List ETag fingerprint without joining the page query:
+-- every conversation row change bumps revision → MAX(updated_at), COUNT(*),
+-- MAX(id), SUM(revision) over conversations notice any change to the rows
+-- (even several in the same second); message writes are caught by
+-- MAX(id), COUNT(*) over the user's chat_history (ix_ch_uid_role_id covers it)
+
+ALTER TABLE conversations ADD COLUMN revision INT UNSIGNED NOT NULL DEFAULT 0;
+
+-- Fingerprint reads only this index (user / is_active filters or none)
+-- Replaces 002's ix_conv_uid_active_updated, a prefix of it
+ALTER TABLE conversations
+    DROP INDEX ix_conv_uid_active_updated,
+    ADD INDEX ix_conv_fingerprint (user_id, is_active, updated_at DESC, revision);
+
+CREATE TRIGGER trg_conv_revision BEFORE UPDATE ON conversations
+FOR EACH ROW SET NEW.revision = OLD.revision + 1;
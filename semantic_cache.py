@@ -0,0 +1,88 @@
+"""
+semantic_cache.py
+Reuse an earlier AI reply when the same user asks (nearly) the same thing again in the same chat
+(chats differ in uploaded files → a reply is never reused across them)
+Off unless SEMANTIC_CACHE=1 and the embedding deps are installed
+"""
+
+import os
+import threading
+import time
+from cachetools import LRUCache
+from embeddings import HAVE_EMBEDDINGS, embed, new_index, as_ids
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1" and HAVE_EMBEDDINGS
+
+# Cosine similarity needed for a hit (bge-small: ~0.9+ = paraphrase)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = 3600
+SEMANTIC_CACHE_MAX_PER_CHAT = 500
+SEMANTIC_CACHE_MAX_CHATS = 1_000
+
+# (user_id, conversation_id) → {"index": faiss index, "replies": {id: (reply, expires_at)}, "next_id": int}
+# LRU → chats nobody asks in anymore drop out with their index
+_caches = LRUCache(maxsize=SEMANTIC_CACHE_MAX_CHATS)
+_lock = threading.Lock()
+
+
+def cache_text(message, history):
+    """What gets embedded → the question plus the turn before it, so follow-ups stay contextual"""
+    if history:
+        return f"{history[-1]['content'][:500]}\n{message}"
+    return message
+
+
+def _evict(entry, now):
+    """Drop expired replies, then the oldest ones past the per-chat cap"""
+    replies = entry["replies"]
+    dead = [i for i, (_, expires_at) in replies.items() if expires_at <= now]
+    overflow = len(replies) - len(dead) - SEMANTIC_CACHE_MAX_PER_CHAT
+    if overflow > 0:
+        expired = set(dead)
+        live = sorted(i for i in replies if i not in expired)
+        dead.extend(live[:overflow])
+    if dead:
+        entry["index"].remove_ids(as_ids(dead))
+        for i in dead:
+            del replies[i]
+
+
+def semantic_lookup(user_id, conversation_id, message, history):
+    """
+    (cached reply or None, query vector)
+    The vector is handed back so a miss can be stored without embedding twice
+    """
+    vector = embed([cache_text(message, history)])
+
+    key = (user_id, conversation_id)
+    with _lock:
+        entry = _caches.get(key)
+        if not entry:
+            return None, vector
+        _evict(entry, time.monotonic())
+        if not entry["replies"]:
+            # Everything expired → free the index too
+            _caches.pop(key, None)
+            return None, vector
+
+        scores, ids = entry["index"].search(vector, 1)
+        if ids[0][0] != -1 and scores[0][0] >= SEMANTIC_CACHE_THRESHOLD:
+            reply, _ = entry["replies"][int(ids[0][0])]
+            return reply, vector
+
+    return None, vector
+
+
+def semantic_store(user_id, conversation_id, vector, reply):
+    """Remember reply for the query behind vector"""
+    key = (user_id, conversation_id)
+    with _lock:
+        entry = _caches.get(key)
+        if entry is None:
+            entry = _caches[key] = {"index": new_index(removable=True), "replies": {}, "next_id": 0}
+
+        entry_id = entry["next_id"]
+        entry["next_id"] += 1
+        entry["index"].add_with_ids(vector, as_ids([entry_id]))
+        entry["replies"][entry_id] = (reply, time.monotonic() + SEMANTIC_CACHE_TTL)
+        _evict(entry, time.monotonic())